@@ -0,0 +1,92 @@
+"""
+parse_benchmark - listing pages parsed per second, in this process vs. a ParsePool
+
+Synthetic rarbg listing pages (25 rows each, like the real ones) are parsed once with
+listing_parser.parse_listing in a loop, then across ParsePool workers, and both throughputs
+are printed. Run from the repository root:
+
+    python mcp_server/benchmarks/parse_benchmark.py --pages 400 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rarbg.listing_parser import available_backends, parse_listing  # noqa: E402
+from rarbg.parse_pool import ParsePool  # noqa: E402
+
+
+def listing_row(n):
+    infohash = '%040X' % (n * 7919 + 12345)
+    return (
+        '<tr class="lista2">'
+        '<td class="lista"><a href="/torrents.php?category=44">'
+        '<img src="https://dyncdn.me/static/20/images/categories/cat_new44.gif"></a></td>'
+        '<td class="lista"><a onmouseover="return overlib(\'<img src=\\\'https://dyncdn.me/mimages/over/%s.jpg\\\'>\')" '
+        'href="/torrent/movie-%d.html" title="Movie.%d.2019.1080p.BluRay.x264">Movie.%d.2019.1080p.BluRay.x264</a>'
+        '<br><span style="color:DarkSlateGray">Drama, Thriller IMDB: 7.%d/10</span></td>'
+        '<td class="lista">2019-%02d-%02d 10:00:00</td>'
+        '<td class="lista">%d.%d GB</td>'
+        '<td class="lista"><font color="#008000">%d</font></td>'
+        '<td class="lista">%d</td>'
+        '<td class="lista">uploader%d</td>'
+        '</tr>'
+    ) % (infohash.lower(), n, n, n, n % 10, n % 12 + 1, n % 28 + 1, n % 9 + 1, n % 10, n * 37 % 101, n % 13, n % 3)
+
+
+def listing_page(page, rows=25, total_pages=100):
+    body = ''.join(listing_row((page - 1) * rows + j) for j in range(rows))
+    pager = ''.join('<a href="/torrents.php?page=%d">%d</a>' % (k, k) for k in range(1, total_pages + 1))
+    return (
+        '<html><head><title>rarbg</title></head><body><table class="lista2t"><tr><td class="header6">Cat.</td>'
+        '<td class="header6">File</td></tr>%s</table><div id="pager_links">%s</div></body></html>'
+    ) % (body, pager)
+
+
+def bench_single(pages, backend):
+    start = time.perf_counter()
+    rows = sum(len(parse_listing(page, backend=backend)[0]) for page in pages)
+    return time.perf_counter() - start, rows
+
+
+def bench_pool(pages, workers, backend):
+    with ParsePool(workers, backend) as pool:
+        pool.parse_listings(pages[:workers])  # spawn and warm up the workers, not part of the measurement
+        start = time.perf_counter()
+        rows = sum(len(page_rows) for page_rows, _ in pool.parse_listings(pages))
+        elapsed = time.perf_counter() - start
+
+        # the way the search client uses it: one awaitable parse per fetched page
+        async def parse_all():
+            return await asyncio.gather(*(pool.parse_listing(page) for page in pages))
+
+        start = time.perf_counter()
+        asyncio.run(parse_all())
+        async_elapsed = time.perf_counter() - start
+    return elapsed, async_elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=400, help='listing pages to parse')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='ParsePool worker processes')
+    parser.add_argument('--backend', choices=available_backends(), default=None, help='listing_parser backend')
+    args = parser.parse_args()
+
+    pages = [listing_page(page).encode('utf8') for page in range(1, args.pages + 1)]
+    print(f'{args.pages} pages, {sum(map(len, pages)) / 2 ** 20:.1f} MiB, backend {args.backend or available_backends()[0]}')
+
+    elapsed, rows = bench_single(pages, args.backend)
+    print(f'single process:    {args.pages / elapsed:8.1f} pages/s  ({rows} rows)')
+    pool_elapsed, async_elapsed, pool_rows = bench_pool(pages, args.workers, args.backend)
+    print(f'pool, {args.workers} workers:   {args.pages / pool_elapsed:8.1f} pages/s  ({pool_rows} rows)'
+          f'  x{elapsed / pool_elapsed:.2f}')
+    print(f'pool, awaited:     {args.pages / async_elapsed:8.1f} pages/s')
+
+
+if __name__ == '__main__':
+    main()
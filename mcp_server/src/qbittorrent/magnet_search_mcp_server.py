@@ -1,10 +1,15 @@
+import asyncio
 import json
 import logging
 import mcp.types as types
 from pydantic import Field
 from dotenv import load_dotenv
-from fastmcp import FastMCP
-from rarbg import rarbgcli
+from fastmcp import Context, FastMCP
+from rarbg.client import RarbgSearchClient
+from rarbg.local_index import TorrentIndex
+from rarbg.mirrors import MirrorManager
+from rarbg.search_cache import MagnetCache, QueryCache
+from rarbg.settings import COOKIES_PATH, MAGNET_CACHE_PATH, QUERY_CACHE_PATH, TORRENT_INDEX_PATH
 from config.mcp_server_config import MAGNET_SEARCH_MCP_SERVER_CONFIG
 
 logging.basicConfig(
@@ -15,9 +20,36 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 mcp = FastMCP("magnet_search_mcp_server")
 
+# rows scraped within this many seconds answer a query without going to the mirror
+LOCAL_INDEX_MAX_AGE = 6 * 60 * 60
+# titles of one get_download_urls call searched at the same time
+BATCH_CONCURRENCY = 4
+# seconds one title's search may take before the tool gives up on it, so a hung mirror can't pin the worker
+SEARCH_DEADLINE = 90
+
+_client = None
+
+
+def get_client() -> RarbgSearchClient:
+    # kept for the lifetime of the server, so its connection pool, cookies and caches are reused across tool calls
+    global _client
+    if _client is None:
+        _client = RarbgSearchClient(
+            "rargb.to",
+            cookies_path=COOKIES_PATH,
+            cache=QueryCache(QUERY_CACHE_PATH),
+            magnet_cache=MagnetCache(MAGNET_CACHE_PATH),
+            index=TorrentIndex(TORRENT_INDEX_PATH),
+            # a dead mirror fails over to the next fastest one instead of hanging the tool call
+            mirrors=MirrorManager(),
+            hedge=True,
+            deadline=SEARCH_DEADLINE
+        )
+    return _client
+
 
 @mcp.tool
-def get_download_url(
+async def get_download_url(
         query: str = Field(description="The search query movie name ")
 ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
     """
@@ -47,14 +79,18 @@ def get_download_url(
                     ]
     """
     logger.info(f"Searching for movie: {query}")
-    args = [
-        query,
-        "--magnet",
-        "--category", "movies",
-        "--order", "size",
-        "--limit", "1"
-    ]
-    result = rarbgcli.cli(args)
+    client = get_client()
+    records = await client.asearch_local(query, category="movies", order="size", limit=1, max_age=LOCAL_INDEX_MAX_AGE)
+    if records:
+        logger.info(f"Answered from the local index: {query}")
+        result = [record.magnet for record in records]
+    else:
+        result = []
+        try:
+            async for record in client.iter_search(query, category="movies", order="size", limit=1):
+                result.append(record.magnet)
+        except asyncio.TimeoutError:
+            logger.warning(f"Search for {query} took longer than {SEARCH_DEADLINE}s, returning what was found")
     logger.info(f"Found {len(result)} results for query: {query}")
     return [
         types.TextContent(
@@ -63,6 +99,56 @@ def get_download_url(
     ]
 
 
+@mcp.tool
+async def get_download_urls(
+        queries: list[str] = Field(description="The movie names to search, one per title"),
+        ctx: Context = None
+) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    """
+           find the magnet download urls of many movies from rarbg in one call.
+           Each title is searched like `get_download_url` does (largest file size first), several at a time
+           over one shared session, and progress is reported as each title completes.
+
+           Args:
+               queries (`list[str]`):
+                   The query movie names. The query names must be English.
+           Returns:
+               dict[str, list[str]]. For each title, the magnet urls found (empty when rarbg doesn't have it).
+
+
+           Example:
+               .. code-block:: python
+
+                   results = get_download_urls(queries=["Before Sunrise", "Before Sunset"])
+                   print(results)
+
+               It returns the following string.
+
+               .. code-block:: python
+
+                    {
+                        "Before Sunrise": ["magnet:?xt=urn:btih:8094D7EA2D291AB2571004E7B56E457710FBE7E6&dn=Before.Sunrise.1995.Criterion.1080p.Remux.Bluray.FLAC.h264-LAA"],
+                        "Before Sunset": ["magnet:?xt=urn:btih:..."]
+                    }
+    """
+    logger.info(f"Searching for {len(queries)} movies: {queries}")
+    client = get_client()
+    results = {}
+    async for result in client.iter_search_many(
+            queries, category="movies", order="size", limit=1, concurrency=BATCH_CONCURRENCY,
+            local_max_age=LOCAL_INDEX_MAX_AGE
+    ):
+        results[result.query] = [record.magnet for record in result.records]
+        logger.info(f"Found {len(result.records)} results for query: {result.query}")
+        if ctx is not None:
+            await ctx.report_progress(len(results), len(set(queries)))
+    return [
+        types.TextContent(
+            type="text", text=json.dumps({query: results.get(query, []) for query in queries}, ensure_ascii=False)
+        )
+    ]
+
+
 class MagnetSearchMcpServer:
     def __init__(self):
         load_dotenv()
@@ -1,3 +1,33 @@
-from . import download_tesseract, get_chrome_driver, rarbgcli
+from . import download_tesseract, get_chrome_driver, http_engine, listing_parser, rarbgcli
+from .client import RarbgSearchClient
+from .cookie_store import CookieStore
+from .local_index import TorrentIndex
+from .mirrors import MirrorManager
+from .parse_pool import ParsePool
+from .record_index import RecordIndex
+from .records import TorrentRecord
+from .search_cache import MagnetCache, QueryCache
+from .snapshots import SnapshotWriter
+from .table import TorrentTable
+from .watch import Watcher, WatchStore
 
-__all__ = ["download_tesseract", "get_chrome_driver", "rarbgcli"]
+__all__ = [
+    "download_tesseract",
+    "get_chrome_driver",
+    "http_engine",
+    "listing_parser",
+    "rarbgcli",
+    "CookieStore",
+    "MagnetCache",
+    "MirrorManager",
+    "ParsePool",
+    "QueryCache",
+    "RarbgSearchClient",
+    "RecordIndex",
+    "SnapshotWriter",
+    "TorrentIndex",
+    "TorrentTable",
+    "TorrentRecord",
+    "Watcher",
+    "WatchStore",
+]
@@ -0,0 +1,835 @@
+"""
+client - importable rarbg / torrentgalaxy search API
+
+RarbgSearchClient keeps its fetch engine (connection pool and cookies) and its detail page cache
+for its whole lifetime, and returns TorrentRecord objects without printing or writing any files.
+The CLI in rarbgcli is a thin wrapper around it.
+
+Example usage:
+
+    client = RarbgSearchClient('rargb.to', cookies_path=COOKIES_PATH)
+    records = client.search('before sunrise', category='movies', order='size', limit=1)
+    print(records[0].magnet)
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from concurrent import futures
+from contextlib import aclosing
+from urllib.parse import quote
+
+from .cookie_store import CookieStore
+from .http_engine import FetchEngine
+from .listing_parser import ListingStreamParser, parse_detail, parse_listing, stream_parsing_available
+from .local_index import DEFAULT_MAX_AGE
+from .magnets import build_magnet
+from .mirrors import MIRROR_ERRORS
+from .record_index import RecordIndex
+from .records import TorrentRecord, detail_path
+from .settings import CATEGORY2CODE, CODE2CATEGORY, TORRENTGALAXY_CATEGORY2CODE, TORRENTGALAXY_DOMAINS
+from .topk import TopK, server_ordered
+
+logger = logging.getLogger(__name__)
+
+SORT_KEYS = ('title', 'date', 'size', 'seeders', 'leechers')
+
+DEFAULT_BATCH_CONCURRENCY = 4
+# resolved detail pages remembered in memory, the magnet cache (on disk) has the rest
+DETAIL_MEMO_SIZE = 4096
+
+# one listing page, `row_count` is the number of rows on the page before any filtering
+SearchPage = namedtuple('SearchPage', ['number', 'total_pages', 'records', 'row_count', 'response'])
+# the outcome of one title of a batch search, `error` is the exception its search raised, if any
+BatchResult = namedtuple('BatchResult', ['query', 'records', 'error'])
+
+
+def torrent_file_url(href, text, domain='rarbgunblocked.org'):
+    return (
+            'https://'
+            + domain
+            + href.replace('torrent/', 'download.php?id=')
+            + '&f='
+            + quote(text + '-[rarbg.to].torrent')
+            + '&tpageurl='
+            + quote(href.strip())
+    )
+
+
+def build_url(search, page, category, domain, order, sort_order, torrentgalaxy_mode=False):
+    if not torrentgalaxy_mode:
+        target_url = 'https://{domain}/torrents.php?search={search}&page={page}'
+        target_url_formatted = target_url.format(
+            domain=domain.strip(),
+            search=quote(search),
+            page=page,
+        )
+        if sort_order:
+            target_url_formatted += '&by=' + sort_order.upper().strip()
+        if order:
+            target_url_formatted += '&order=' + order.strip()
+        if category:
+            target_url_formatted += '&category=' + ';'.join(CATEGORY2CODE[category])
+        return target_url_formatted
+    else:
+        target_url = 'https://{domain}/{category}/{page}?search={search}'
+        target_url_formatted = target_url.format(
+            domain=domain.strip().rstrip('/'),
+            search=quote(search),
+            page=page,
+            category='search' if len(search) else TORRENTGALAXY_CATEGORY2CODE.get(category, ''),
+        )
+        if sort_order:
+            target_url_formatted += '&by=' + sort_order.upper().strip()
+        if order:
+            target_url_formatted += '&order=' + order.strip()
+        return target_url_formatted
+
+
+def topk_slack(limit):
+    """extra top-k candidates kept to backfill rows without a magnet link, up to one listing page"""
+    return int(min(limit, 25)) if limit < float('inf') else 0
+
+
+_DONE = object()
+
+
+async def _anext(agen, timeout=None):
+    """
+    next item of an async generator, or _DONE once it is exhausted (coroutine form, for run_coroutine_threadsafe).
+    with `timeout`, raises asyncio.TimeoutError after the step was cancelled and has unwound, so `agen` can be closed
+    """
+    try:
+        if timeout is None:
+            return await agen.__anext__()
+        return await asyncio.wait_for(agen.__anext__(), timeout)
+    except StopAsyncIteration:
+        return _DONE
+
+
+async def _aclose(agen):
+    """
+    close an async generator on its own loop. a step cancelled from another thread or loop may still be
+    unwinding (aclose would raise RuntimeError then), so wait for it first
+    """
+    while agen.ag_running:
+        await asyncio.sleep(0.01)
+    await agen.aclose()
+
+
+def normalize_domain(domain):
+    domain = domain.strip()
+    for scheme in ('https://', 'http://'):
+        if domain.startswith(scheme):
+            domain = domain[len(scheme):]
+    return domain.rstrip('/')
+
+
+def is_torrentgalaxy_domain(domain):
+    return 'https://' + normalize_domain(domain) in TORRENTGALAXY_DOMAINS
+
+
+class RarbgSearchClient:
+    """
+    reusable search client, safe to keep for the lifetime of a process
+
+    :param domain: mirror to search, e.g. 'rargb.to'
+    :param cookies: initial cookies, read from `cookies_path` when not given
+    :param cookies_path: json file cookies are loaded from and saved to after a CAPTCHA is solved,
+        None to keep cookies in memory only
+    :param engine: FetchEngine to share with other clients, a private one is created by default
+    :param torrentgalaxy_mode: force the torrentgalaxy page layout, detected from the domain by default
+    :param parser_backend: one of listing_parser.BACKENDS, the fastest installed one by default
+    :param on_threat_defence: callable(url) -> cookies, defaults to threat_defence.deal_with_threat_defence
+    :param cache: search_cache.QueryCache answering repeated searches without any HTTP request, None to disable
+    :param magnet_cache: search_cache.MagnetCache persisting resolved detail pages, None to keep them in memory only
+    :param index: local_index.TorrentIndex every scraped row is added to, for `search_local`, None to disable
+    :param mirrors: mirrors.MirrorManager, routes each search to the fastest healthy mirror instead of `domain`
+        and fails over to the next one when a mirror times out or errors
+    :param hedge: with `mirrors`, request the first listing page from the two best mirrors and keep the fastest
+    :param trackers: trackers of the magnet links built from listing rows, settings.MAGNET_TRACKERS by default
+    :param scheduler: scheduler.FetchScheduler of the private engine, ignored when `engine` is given
+    :param deadline: seconds a whole search may take, including retries and magnet resolution, before
+        asyncio.TimeoutError is raised. None for no limit
+    :param parse_pool: parse_pool.ParsePool to parse pages in worker processes (with its own backend),
+        None to parse on the engine loop
+    :param window: records a search keeps in memory to deduplicate against, so memory stays flat however
+        many pages it spans. searches that outgrow it aren't cached. None to keep every record
+    :param stream_parse: parse listing pages while they download when a search has a limit (and no prefetch),
+        so the first records come before the page is complete. such searches aren't cached. on by default
+        when lxml is installed
+    """
+
+    def __init__(
+            self,
+            domain='rargb.to',
+            cookies=None,
+            cookies_path=None,
+            engine=None,
+            torrentgalaxy_mode=None,
+            parser_backend=None,
+            on_threat_defence=None,
+            cache=None,
+            magnet_cache=None,
+            index=None,
+            mirrors=None,
+            hedge=False,
+            trackers=None,
+            scheduler=None,
+            deadline=None,
+            parse_pool=None,
+            window=None,
+            stream_parse=None,
+    ):
+        self.domain = normalize_domain(domain)
+        self.torrentgalaxy_mode = is_torrentgalaxy_domain(self.domain) if torrentgalaxy_mode is None else torrentgalaxy_mode
+        self.cookies_path = cookies_path
+        self.parser_backend = parser_backend
+        self.cache = cache
+        self.magnet_cache = magnet_cache
+        self.index = index
+        self.mirrors = mirrors
+        self.hedge = hedge
+        self.trackers = trackers
+        self.deadline = deadline
+        self.parse_pool = parse_pool
+        self.window = window
+        self.stream_parse = stream_parsing_available() if stream_parse is None else stream_parse
+        if engine is None:
+            if on_threat_defence is None:
+                from .threat_defence import deal_with_threat_defence as on_threat_defence
+            engine = FetchEngine(
+                on_threat_defence=on_threat_defence,
+                cookie_store=CookieStore(cookies_path, cookies),
+                scheduler=scheduler,
+            )
+        elif cookies is not None:
+            engine.set_cookies(cookies)
+        self.engine = engine
+        self._details = OrderedDict()  # detail page path -> (magnet, torrent file href), least recently used first
+        self._resolving = {}  # detail page path -> task fetching it, so concurrent requests share one fetch
+        if mirrors is not None:
+            mirrors.start(self.engine)
+
+    @property
+    def scheduler(self):
+        """the FetchScheduler every request of this client goes through, see its `stats` for queue / in-flight metrics"""
+        return self.engine.scheduler
+
+    @property
+    def table_offset(self):
+        return 1 if self.torrentgalaxy_mode else 0
+
+    def _is_torrentgalaxy(self, domain):
+        return self.torrentgalaxy_mode if domain == self.domain else is_torrentgalaxy_domain(domain)
+
+    def page_url(self, query, page, category='', order='', sort_order=None, domain=None):
+        domain = domain or self.domain
+        return build_url(query, page, category, domain, order, sort_order, torrentgalaxy_mode=self._is_torrentgalaxy(domain))
+
+    def _record(self, row, domain=None):
+        domain = domain or self.domain
+        return TorrentRecord(
+            title=row.title,
+            torrent=torrent_file_url(row.href, row.text, domain=domain),
+            href=f'https://{domain}{row.href}',
+            date=row.date,
+            category=CODE2CATEGORY.get(row.category_code, 'UNKOWN'),
+            size=row.size,
+            seeders=row.seeders,
+            leechers=row.leechers,
+            uploader=row.uploader,
+            magnet=build_magnet(row.infohash, row.title, self.trackers) if row.infohash else '',
+        )
+
+    @staticmethod
+    def _matches_category(record, category):
+        if category == 'nonxxx':
+            return record.category != 'xxx'
+        return not category or record.category == category
+
+    # == magnet resolution ==
+
+    async def _resolve_href(self, href, infohash=''):
+        """
+        (magnet, torrent file href) scraped from a detail page, failures are not cached. pages are remembered by
+        path, so a torrent resolved on one mirror isn't fetched again on another, or by `infohash` when known
+        """
+        path = detail_path(href)
+        if path in self._details:
+            self._details.move_to_end(path)
+            return self._details[path]
+        if self.magnet_cache is not None:
+            cached = self.magnet_cache.get(href, infohash)
+            if cached is not None:
+                self._remember(path, cached)
+                return cached
+        task = self._resolving.get(path)
+        if task is None:
+            task = self._resolving[path] = asyncio.ensure_future(self._fetch_detail(href))
+            task.add_done_callback(lambda _: self._resolving.pop(path, None))
+        # shielded so that one cancelled caller doesn't cancel the fetch for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def _remember(self, href, links):
+        # bounded, a long running process (e.g. the MCP server) would otherwise keep every detail page it resolved
+        self._details[href] = links
+        self._details.move_to_end(href)
+        if len(self._details) > DETAIL_MEMO_SIZE:
+            self._details.popitem(last=False)
+
+    async def _fetch_detail(self, href):
+        try:
+            r = await self.engine.fetch(href)
+            if self.parse_pool is not None:
+                magnet, torrent_file = await self.parse_pool.parse_detail(r.content, r.charset_encoding)
+            else:
+                magnet, torrent_file = parse_detail(r.content, self.parser_backend, r.charset_encoding)
+        except Exception as e:
+            logger.debug('failed to fetch magnet link from %s: %s', href, e)
+            return '', None
+        if magnet:
+            self._remember(detail_path(href), (magnet, torrent_file))
+            if self.magnet_cache is not None:
+                self.magnet_cache.put(href, magnet, torrent_file)
+        return magnet, torrent_file
+
+    async def resolve(self, record):
+        """fill in the magnet link of `record` from its detail page when the listing didn't have it"""
+        if not record.magnet:
+            magnet, torrent_file = await self._resolve_href(record.href, record.infohash)
+            if magnet:
+                record.magnet, record.torrent_file = magnet, torrent_file
+                if self.index is not None:
+                    self.index.add([record])
+        return record
+
+    def resolve_href(self, href, infohash=''):
+        return self.engine.run(self._resolve_href(href, infohash))
+
+    # == mirrors ==
+
+    async def _fetch_listing(self, query, page, category, order, sort_order, domain, headers=None, stream=False):
+        """
+        GET one listing page from `domain`, reporting its latency or failure to the mirror manager.
+        with `stream`, the body is left unread, see FetchEngine.fetch
+        """
+        url = self.page_url(query, page, category, order, sort_order, domain)
+        if self.mirrors is None:
+            return await self.engine.fetch(url, headers=headers, stream=stream)
+        start = time.monotonic()
+        try:
+            # no retries on the same mirror, failing over to the next one is the retry
+            r = await self.engine.fetch(url, timeout=self.mirrors.timeout, headers=headers, retries=0, stream=stream)
+        except MIRROR_ERRORS:
+            self.mirrors.record_failure(domain)
+            raise
+        if r.status_code >= 500:
+            self.mirrors.record_failure(domain)
+        else:
+            self.mirrors.record_success(domain, time.monotonic() - start)
+        return r
+
+    async def _fetch_page(self, query, page, category, order, sort_order, domain, exclude=(), headers=None,
+                          stream=False):
+        """
+        (response, domain) of a listing page. when `domain` times out or errors, the page is requested from
+        the next best mirror, and the domain it finally came from is returned so the rest of the search sticks to it
+        """
+        tried = list(exclude)
+        while True:
+            try:
+                r = await self._fetch_listing(query, page, category, order, sort_order, domain, headers, stream)
+            except MIRROR_ERRORS as e:
+                if self.mirrors is None:
+                    raise
+                r, error = None, e
+            else:
+                if self.mirrors is None or r.status_code < 500:
+                    return r, domain
+                error = f'error {r.status_code}'
+            tried.append(domain)
+            fallback = self.mirrors.best(exclude=tried)
+            if fallback is None:
+                if r is None:
+                    raise error
+                return r, domain
+            logger.warning('mirror %s failed (%s), failing over to %s', domain, str(error) or type(error).__name__, fallback)
+            if r is not None:
+                await r.aclose()
+            domain = fallback
+
+    async def _fetch_hedged(self, query, page, category, order, sort_order, headers=None, stream=False):
+        """
+        race the two best mirrors for a listing page, the slower request is cancelled.
+        with `stream`, the winner's body is left unread and the responses that lost are closed
+        """
+        domains = self.mirrors.ranked()[:2]
+        tasks = {
+            asyncio.ensure_future(self._fetch_page(
+                query, page, category, order, sort_order, domain, exclude=domains, headers=headers, stream=stream
+            ))
+            for domain in domains
+        }
+        finished, winner = [], None
+        try:
+            while True:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finished.extend(done)
+                for task in done:
+                    if task.exception() is None and task.result()[0].status_code in (200, 304):
+                        winner = task
+                        return task.result()
+                if not tasks:
+                    winner = task
+                    return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if stream:
+                for task in finished:
+                    if task is not winner and task.exception() is None:
+                        await task.result()[0].aclose()
+
+    def _hedges(self, page):
+        """whether `page` is requested from the two best mirrors at once, see `hedge`"""
+        return page == 1 and self.hedge and self.mirrors is not None and len(self.mirrors.domains) > 1
+
+    def _first_domain(self):
+        if self.mirrors is None:
+            return self.domain
+        return self.mirrors.best() or self.domain
+
+    # == searching ==
+
+    async def _listing_pages(self, query, category='', order='', sort_order=None, prefetch=0, headers=None):
+        """
+        async generator of SearchPage in page order, with records filtered by category but not yet resolved.
+        must run on the engine loop
+
+        :param headers: extra headers of the first page request. when they make it conditional and the mirror
+            answers 304 Not Modified, a single empty page carrying that response is yielded
+        """
+        prefetched = {}  # page number -> task of a page requested ahead of time
+        page = 1
+        domain = self._first_domain()
+        try:
+            while True:
+                task = prefetched.pop(page, None)
+                if task is not None:
+                    r, domain = await task
+                elif self._hedges(page):
+                    r, domain = await self._fetch_hedged(query, page, category, order, sort_order, headers)
+                else:
+                    r, domain = await self._fetch_page(
+                        query, page, category, order, sort_order, domain, headers=headers if page == 1 else None
+                    )
+                if r.status_code == 304:
+                    logger.debug('page %d not modified at %s', page, r.url)
+                    yield SearchPage(page, None, [], 0, r)
+                    return
+                table_offset = 1 if self._is_torrentgalaxy(domain) else 0
+                if self.parse_pool is not None:
+                    rows, total_pages = await self.parse_pool.parse_listing(
+                        r.content, table_offset, encoding=r.charset_encoding
+                    )
+                else:
+                    # the raw bytes, the backends decode them once themselves
+                    rows, total_pages = parse_listing(
+                        r.content, table_offset, self.parser_backend, encoding=r.charset_encoding
+                    )
+
+                # pages are still yielded in order, this only gets the next responses in flight early
+                if prefetch and total_pages:
+                    for p in range(page + 1, min(page + prefetch, total_pages) + 1):
+                        if p not in prefetched:
+                            prefetched[p] = asyncio.ensure_future(
+                                self._fetch_page(query, p, category, order, sort_order, domain)
+                            )
+
+                if r.status_code != 200:
+                    logger.warning('error %s at %s', r.status_code, r.url)
+                    return
+                logger.debug('%d torrents found in page %d', len(rows), page)
+                if not rows:
+                    return
+
+                yield SearchPage(page, total_pages, self._page_records(rows, domain, category), len(rows), r)
+                page += 1
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+
+    def _page_records(self, rows, domain, category):
+        """records of listing rows, added to the index, then filtered by category"""
+        records = [self._record(row, domain) for row in rows]
+        if self.index is not None:
+            self.index.add(records)
+        return [record for record in records if self._matches_category(record, category)]
+
+    async def _streamed_listing(self, query, category='', order='', sort_order=None):
+        """
+        async generator of lists of records (filtered by category, not yet resolved) parsed while the
+        listing pages download, a list per received chunk that completed rows. the first page is hedged
+        like in `_listing_pages`. must run on the engine loop.
+        when a body breaks off part way, the page is requested again (from the next mirror, or after a backoff
+        without mirrors) and the rows already yielded are skipped
+        """
+        page = 1
+        domain = self._first_domain()
+        while True:
+            done, tried, attempt = 0, [], 0  # rows of the page yielded so far, mirrors whose body failed
+            while True:
+                if self._hedges(page) and not tried:
+                    r, domain = await self._fetch_hedged(query, page, category, order, sort_order, stream=True)
+                else:
+                    r, domain = await self._fetch_page(
+                        query, page, category, order, sort_order, domain, exclude=tried, stream=True
+                    )
+                try:
+                    if r.status_code != 200:
+                        logger.warning('error %s at %s', r.status_code, r.url)
+                        return
+                    table_offset = 1 if self._is_torrentgalaxy(domain) else 0
+                    parser = ListingStreamParser(table_offset, encoding=r.charset_encoding, backend=self.parser_backend)
+                    row_count = 0
+                    try:
+                        async for chunk in r.aiter_bytes():
+                            rows = parser.feed(chunk)
+                            row_count, rows = row_count + len(rows), rows[max(0, done - row_count):]
+                            if rows:
+                                done = row_count
+                                yield self._page_records(rows, domain, category)
+                        rows = parser.close()
+                    except MIRROR_ERRORS as e:
+                        error = e
+                    else:
+                        row_count, rows = row_count + len(rows), rows[max(0, done - row_count):]
+                        if rows:
+                            done = row_count
+                            yield self._page_records(rows, domain, category)
+                        break
+                finally:
+                    await r.aclose()
+                # the body broke off after the headers, which the fetch retries and mirror failover don't cover
+                if self.mirrors is not None:
+                    self.mirrors.record_failure(domain)
+                    tried.append(domain)
+                    fallback = self.mirrors.best(exclude=tried)
+                    if fallback is None:
+                        raise error
+                    logger.warning('mirror %s failed reading page %d (%s), failing over to %s', domain, page,
+                                   str(error) or type(error).__name__, fallback)
+                    domain = fallback
+                else:
+                    attempt += 1
+                    if attempt > self.engine.retries:
+                        raise error
+                    delay = self.engine._backoff(attempt)
+                    logger.info('%s reading page %d, retry %d/%d in %.1fs', str(error) or type(error).__name__, page,
+                                attempt, self.engine.retries, delay)
+                    await asyncio.sleep(delay)
+            logger.debug('%d torrents found in page %d', row_count, page)
+            if not row_count:
+                return
+            page += 1
+
+    async def _record_batches(self, query, category='', order='', sort_order=None, prefetch=0, stream=False):
+        """unresolved records of a search, a list per page, or per received chunk with `stream`"""
+        if stream:
+            source = self._streamed_listing(query, category, order, sort_order)
+        else:
+            source = self._listing_pages(query, category, order, sort_order, prefetch)
+        async with aclosing(source) as batches:
+            async for batch in batches:
+                yield batch if stream else batch.records
+
+    async def _take(self, records, limit=float('inf'), show_empty=False, seen=None):
+        """
+        async generator resolving `records` in order, only as many at a time as are still needed to reach `limit`.
+        records left without a magnet link are skipped unless `show_empty`, and so are torrents already
+        yielded under another detail page (same infohash), in this call or in earlier ones sharing `seen`.
+        each record is yielded as soon as it and the ones before it are resolved, not once its whole window is
+        """
+        taken = 0
+        pending = list(records)
+        seen = RecordIndex() if seen is None else seen
+        while pending and taken < limit:
+            needed = int(min(limit - taken, len(pending)))
+            window, pending = pending[:needed], pending[needed:]
+            tasks = [asyncio.ensure_future(self.resolve(record)) for record in window]
+            try:
+                for record, task in zip(window, tasks):
+                    await task
+                    if (record.magnet or show_empty) and seen.add(record):
+                        taken += 1
+                        yield record
+            finally:
+                # e.g. closed at the limit or a deadline, the detail fetches themselves are shared and carry on
+                for task in tasks:
+                    task.cancel()
+
+    async def _pages(self, query, category='', order='', sort_order=None, show_empty=False, prefetch=0):
+        """async generator of SearchPage with every record of the page resolved"""
+        async with aclosing(self._listing_pages(query, category, order, sort_order, prefetch)) as pages:
+            async for page in pages:
+                records = [record async for record in self._take(page.records, show_empty=show_empty)]
+                yield page._replace(records=records)
+
+    def _iter_sync(self, agen, stop_at=None):
+        """
+        blocking iterator over `agen`. with `stop_at` (a time.monotonic() value), asyncio.TimeoutError is raised
+        once it has passed, even when a fetch is still in flight
+        """
+        try:
+            while True:
+                timeout = None if stop_at is None else max(0.0, stop_at - time.monotonic())
+                try:
+                    item = self.engine.run(_anext(agen, timeout))
+                except futures.TimeoutError:
+                    # before 3.11, run_coroutine_threadsafe turns asyncio.TimeoutError into this one
+                    raise asyncio.TimeoutError() from None
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.engine.run(_aclose(agen))
+
+    def pages(self, query, category='', order='', sort_order=None, show_empty=False, prefetch=0, stop_at=None):
+        """blocking iterator over the result pages of a search, see `_pages` and `_iter_sync` for `stop_at`"""
+        return self._iter_sync(self._pages(query, category, order, sort_order, show_empty, prefetch), stop_at)
+
+    def listing_pages(self, query, category='', order='', sort_order=None, prefetch=0, stop_at=None):
+        """
+        blocking iterator over the result pages of a search, without resolving any magnet links.
+        see `_iter_sync` for `stop_at`
+        """
+        return self._iter_sync(self._listing_pages(query, category, order, sort_order, prefetch), stop_at)
+
+    def iter_records(self, query, category='', order='', limit=float('inf'), sort_order=None, show_empty=False,
+                     prefetch=0, stop_at=None):
+        """
+        blocking iterator over the resolved records of a search as soon as each is ready, see `iter_search`,
+        and `_iter_sync` for `stop_at`
+        """
+        return self._iter_sync(
+            self._iter_records(query, category, order, limit, sort_order, show_empty, prefetch), stop_at
+        )
+
+    def take(self, records, limit=float('inf'), show_empty=False, stop_at=None):
+        """
+        the first `limit` of `records` that have a magnet link, resolving as few detail pages as possible.
+        with `stop_at` (a time.monotonic() value), only those resolved by then
+        """
+        taken = []
+        try:
+            for record in self._iter_sync(self._take(records, limit, show_empty), stop_at):
+                taken.append(record)
+        except asyncio.TimeoutError:
+            logger.info('deadline reached after resolving %d records', len(taken))
+        return taken
+
+    async def _iter_records(self, query, category='', order='', limit=float('inf'), sort_order=None,
+                            show_empty=False, prefetch=0):
+        """
+        async generator of resolved records in listing order, stops fetching pages and resolving rows
+        as soon as `limit` records were yielded
+        """
+        if self.cache is not None:
+            cached = self.cache.get(query, category, order, sort_order, show_empty, limit=limit)
+            if cached is not None:
+                async for record in self._take(cached, limit, show_empty):
+                    yield record
+                return
+
+        scraped, found, complete = RecordIndex(max_records=self.window), 0, True
+        yielded = RecordIndex(max_records=self.window)
+        # when only a few records are needed, rows are taken as they arrive instead of once their page is complete
+        stream = self.stream_parse and not prefetch and limit < float('inf')
+        async with aclosing(self._record_batches(query, category, order, sort_order, prefetch, stream)) as batches:
+            async for batch in batches:
+                records = scraped.extend(batch)
+                async for record in self._take(records, limit - found, show_empty, seen=yielded):
+                    found += 1
+                    yield record
+                if found >= limit:
+                    complete = False
+                    break
+        # a streamed search stops part way through a page, those rows aren't a listing a later (e.g. sorted)
+        # search could be answered from
+        if self.cache is not None and not scraped.evicted and not stream:
+            # unresolved rows are cached too, they get resolved lazily if a later search needs them
+            self.cache.put(query, scraped.records(), category, order, sort_order, show_empty, complete=complete)
+
+    async def iter_search(self, query, category='', order='', limit=float('inf'), sort_order=None, show_empty=False,
+                          prefetch=0):
+        """
+        stream the records of a search as soon as they are parsed and resolved, can be consumed from any event loop.
+        no page is fetched and no detail page is resolved beyond what `limit` needs
+
+            async for record in client.iter_search('before sunrise', category='movies', limit=1):
+                print(record.magnet)
+        """
+        agen = self._iter_records(query, category, order, limit, sort_order, show_empty, prefetch)
+        deadline = None if self.deadline is None else time.monotonic() + self.deadline
+        try:
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                # the deadline runs on the engine loop, where the step can be cancelled and unwound before closing
+                record = await self.engine.arun(_anext(agen, remaining))
+                if record is _DONE:
+                    return
+                yield record
+        finally:
+            await self.engine.arun(_aclose(agen))
+
+    async def _search(self, query, category='', order='', limit=float('inf'), sort='', sort_order=None,
+                      show_empty=False, prefetch=0):
+        if not sort:
+            records = self._iter_records(query, category, order, limit, sort_order, show_empty, prefetch)
+            async with aclosing(records):
+                return [record async for record in records]
+
+        selector = TopK(limit, sort, slack=topk_slack(limit))
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(query, category, order, sort_order, show_empty, limit=limit)
+        if cached is not None:
+            selector.extend(cached)
+        else:
+            scraped, complete = RecordIndex(max_records=self.window), True
+            # when the mirror already orders by the sort key, the first rows are the best ones
+            stop_when_full = server_ordered(order, sort, sort_order)
+            async with aclosing(self._listing_pages(query, category, order, sort_order, prefetch)) as pages:
+                async for page in pages:
+                    selector.extend(scraped.extend(page.records))
+                    if page.row_count >= limit or (stop_when_full and selector.full):
+                        complete = False
+                        break
+            if self.cache is not None and not scraped.evicted:
+                self.cache.put(query, scraped.records(), category, order, sort_order, show_empty, complete=complete)
+        # only the rows that make it past the sort and the limit get their detail page fetched
+        return [record async for record in self._take(selector.sorted(), limit, show_empty)]
+
+    def search(self, query, category='', order='', limit=float('inf'), sort='', sort_order=None, show_empty=False,
+               prefetch=0):
+        """
+        search the mirror and return a list of TorrentRecord
+
+        :param query: search term
+        :param category: one of settings.CATEGORY2CODE
+        :param order: server side ordering (before the query), e.g. 'size' or 'seeders'
+        :param limit: maximum number of records
+        :param sort: client side sort key (after scraping), one of SORT_KEYS, descending
+        """
+        if sort and sort not in SORT_KEYS:
+            raise ValueError(f'sort must be one of {SORT_KEYS}, got {sort!r}')
+        return self.engine.run(asyncio.wait_for(
+            self._search(query, category, order, limit, sort, sort_order, show_empty, prefetch), self.deadline
+        ))
+
+    async def asearch(self, query, category='', order='', limit=float('inf'), sort='', sort_order=None,
+                      show_empty=False, prefetch=0):
+        """`search` for async callers, can be awaited from any event loop"""
+        if sort and sort not in SORT_KEYS:
+            raise ValueError(f'sort must be one of {SORT_KEYS}, got {sort!r}')
+        return await self.engine.arun(asyncio.wait_for(
+            self._search(query, category, order, limit, sort, sort_order, show_empty, prefetch), self.deadline
+        ))
+
+    # == batch search ==
+
+    async def _search_one(self, query, category, order, limit, sort, sort_order, show_empty, local_max_age):
+        if local_max_age is not None and self.index is not None:
+            records = await self._search_local(query, category, order, limit, sort, show_empty, local_max_age)
+            if records:
+                return records
+        return await asyncio.wait_for(
+            self._search(query, category, order, limit, sort, sort_order, show_empty), self.deadline
+        )
+
+    async def _search_many(self, queries, category='', order='', limit=float('inf'), sort='', sort_order=None,
+                           show_empty=False, concurrency=DEFAULT_BATCH_CONCURRENCY, local_max_age=None):
+        """async generator of BatchResult in completion order, at most `concurrency` searches in flight"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def search(query):
+            async with semaphore:
+                try:
+                    records = await self._search_one(
+                        query, category, order, limit, sort, sort_order, show_empty, local_max_age
+                    )
+                except Exception as e:  # one failing title doesn't sink the batch
+                    logger.warning('batch search of %r failed: %r', query, e)
+                    return BatchResult(query, [], e)
+                return BatchResult(query, records, None)
+
+        tasks = [asyncio.ensure_future(search(query)) for query in dict.fromkeys(queries)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def search_many(self, queries, category='', order='', limit=float('inf'), sort='', sort_order=None,
+                    show_empty=False, concurrency=DEFAULT_BATCH_CONCURRENCY, local_max_age=None):
+        """
+        search every title of `queries` over this client's session, yielding a BatchResult per title as soon as
+        its search completes. the other parameters apply to every title, as in `search`
+
+        :param concurrency: titles searched at the same time
+        :param local_max_age: answer titles from the local index first when it has rows this recent (seconds)
+        """
+        if sort and sort not in SORT_KEYS:
+            raise ValueError(f'sort must be one of {SORT_KEYS}, got {sort!r}')
+        return self._iter_sync(self._search_many(
+            queries, category, order, limit, sort, sort_order, show_empty, concurrency, local_max_age
+        ))
+
+    async def iter_search_many(self, queries, category='', order='', limit=float('inf'), sort='', sort_order=None,
+                               show_empty=False, concurrency=DEFAULT_BATCH_CONCURRENCY, local_max_age=None):
+        """`search_many` for async callers, can be consumed from any event loop"""
+        if sort and sort not in SORT_KEYS:
+            raise ValueError(f'sort must be one of {SORT_KEYS}, got {sort!r}')
+        agen = self._search_many(queries, category, order, limit, sort, sort_order, show_empty, concurrency,
+                                 local_max_age)
+        try:
+            while True:
+                result = await self.engine.arun(_anext(agen))
+                if result is _DONE:
+                    return
+                yield result
+        finally:
+            await self.engine.arun(_aclose(agen))
+
+    # == offline search ==
+
+    async def _search_local(self, query, category='', order='', limit=float('inf'), sort='', show_empty=False,
+                            max_age=DEFAULT_MAX_AGE):
+        # over-fetch so that rows whose magnet can't be resolved, or duplicates, can be backfilled
+        records = self.index.search(query, category, order, limit + topk_slack(limit), sort, max_age)
+        return [record async for record in self._take(records, limit, show_empty)]
+
+    def search_local(self, query, category='', order='', limit=float('inf'), sort='', show_empty=False,
+                     max_age=DEFAULT_MAX_AGE):
+        """
+        answer a search from the local index only, no listing page is fetched.
+        only rows scraped within `max_age` seconds are considered, an empty list means the index can't answer
+        """
+        if self.index is None:
+            return []
+        return self.engine.run(self._search_local(query, category, order, limit, sort, show_empty, max_age))
+
+    async def asearch_local(self, query, category='', order='', limit=float('inf'), sort='', show_empty=False,
+                            max_age=DEFAULT_MAX_AGE):
+        """`search_local` for async callers, can be awaited from any event loop"""
+        if self.index is None:
+            return []
+        return await self.engine.arun(self._search_local(query, category, order, limit, sort, show_empty, max_age))
+
+    def close(self):
+        if self.mirrors is not None:
+            self.mirrors.stop()
+        self.engine.close()
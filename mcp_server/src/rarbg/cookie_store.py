@@ -0,0 +1,155 @@
+"""
+cookie_store - process safe cookie jar with single-flight threat defence solving
+
+Cookies live in memory and are only written to disk after they change, atomically (temp file +
+rename) and under an exclusive file lock, so concurrent CLI runs and the MCP server never read a
+half written cookies.json. Solving the CAPTCHA is serialized the same way: while one thread or
+process solves it, every other request that hit the defence page waits and reuses its cookies
+instead of launching its own browser.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path):
+    """exclusive advisory lock on `path` (created if missing), held across processes"""
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class CookieStore:
+    """
+    :param path: json file the cookies are persisted to, None to keep them in memory only
+    :param cookies: initial cookies, override the ones read from `path`
+    """
+
+    def __init__(self, path=None, cookies=None):
+        self.path = path
+        self.generation = 0  # bumped on every change, lets a caller tell whether cookies changed since it looked
+        self._cookies = {}
+        self._signature = None
+        self._lock = threading.RLock()
+        self._solve_lock = threading.Lock()
+        self.reload()
+        if cookies:
+            self.update(cookies, persist=False)
+
+    def get(self):
+        with self._lock:
+            return dict(self._cookies)
+
+    def replace(self, cookies, persist=True):
+        with self._lock:
+            self._cookies = dict(cookies or {})
+            self.generation += 1
+            if persist:
+                self.save()
+
+    def update(self, cookies, persist=True):
+        with self._lock:
+            self._cookies.update(cookies or {})
+            self.generation += 1
+            if persist:
+                self.save()
+
+    # == persistence ==
+
+    def _lock_path(self, suffix='.lock'):
+        return self.path + suffix
+
+    def reload(self):
+        """re-read the file if another process changed it since we last read or wrote it, True when it did"""
+        if self.path is None or _signature(self.path) == self._signature:
+            return False
+        with self._lock, file_lock(self._lock_path()):
+            signature = _signature(self.path)
+            if signature == self._signature:
+                return False
+            try:
+                with open(self.path, 'r') as f:
+                    cookies = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug('could not read cookies from %s: %s', self.path, e)
+                cookies = {}
+            self._signature = signature
+            if cookies != self._cookies:
+                self._cookies = cookies
+                self.generation += 1
+                return True
+            return False
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock, file_lock(self._lock_path()):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.cookies.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self._cookies, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._signature = _signature(self.path)
+
+    # == threat defence ==
+
+    @contextmanager
+    def _solving(self):
+        with self._solve_lock:
+            if self.path is None:
+                yield
+            else:
+                with file_lock(self._lock_path('.solve.lock')):
+                    yield
+
+    def solve(self, url, solver, generation=None):
+        """
+        cookies that pass the threat defence at `url`, running `solver(url)` only if nobody else has
+        refreshed the cookies since `generation` (the value of `self.generation` when the request was sent)
+
+        blocking: meant to run in a worker thread
+        """
+        with self._solving():
+            self.reload()
+            if generation is not None and self.generation != generation:
+                logger.info('threat defence already solved by another request, reusing its cookies')
+                return self.get()
+            cookies = solver(url)
+            self.update(cookies)
+            return self.get()
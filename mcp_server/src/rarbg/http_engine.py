@@ -0,0 +1,287 @@
+"""
+http_engine - asyncio fetch layer for rarbgcli
+
+All listing and detail page fetches go through one long-lived httpx.AsyncClient, so
+connections are kept alive (and multiplexed over HTTP/2 when `h2` is installed) instead of
+paying a TCP+TLS handshake per page. The client lives on a private event loop thread,
+which lets the synchronous CLI and async callers (e.g. the MCP server) share the same pool.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+from .cookie_store import CookieStore
+from .scheduler import OVERLOAD_ERRORS, OVERLOAD_STATUSES, FetchScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36'
+}
+THREAT_DEFENCE_MARKER = 'threat_defence.php'
+
+# transient failures a request is retried on, with jittered exponential backoff
+RETRY_ERRORS = OVERLOAD_ERRORS
+RETRY_STATUSES = OVERLOAD_STATUSES
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def is_threat_defence(url):
+    return THREAT_DEFENCE_MARKER in str(url)
+
+
+class LoopThread:
+    """an event loop running forever on a daemon thread"""
+
+    def __init__(self, name='rarbg-fetch-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class FetchEngine:
+    """
+    shared, keep-alive connection pool with rarbg threat defence handling
+
+    :param cookies: initial cookies (e.g. loaded from cookies.json)
+    :param on_threat_defence: callable(url) -> dict of cookies, called (in a worker thread) when a
+        request gets redirected to the threat defence page. only one call runs at a time, requests
+        hitting the defence page meanwhile reuse its cookies
+    :param on_cookies: callable(dict) called with the new cookies after a threat defence was solved
+    :param cookie_store: cookie_store.CookieStore to share cookies with other engines and processes,
+        an in-memory one holding `cookies` by default
+    :param scheduler: scheduler.FetchScheduler bounding and adapting the requests in flight per domain,
+        one with the default limits when not given
+    :param timeout: seconds to wait for the response once connected (read timeout)
+    :param connect_timeout: seconds to wait for the connection to be established
+    :param retries: times a request failing with a timeout, a transport error, a 429 or a 5xx is retried
+    :param backoff: seconds, base of the exponential backoff between retries (each wait is jittered)
+    :param max_backoff: seconds, cap of a single wait, including a server's Retry-After
+    :param max_threat_defence: threat defence solves attempted for one request before giving up
+    """
+
+    def __init__(
+            self,
+            cookies=None,
+            headers=None,
+            on_threat_defence=None,
+            on_cookies=None,
+            max_connections=20,
+            max_keepalive_connections=10,
+            keepalive_expiry=60.0,
+            http2=None,
+            timeout=30.0,
+            cookie_store=None,
+            scheduler=None,
+            connect_timeout=10.0,
+            retries=3,
+            backoff=0.5,
+            max_backoff=10.0,
+            max_threat_defence=3,
+    ):
+        if cookie_store is None:
+            cookie_store = CookieStore(cookies=cookies)
+        elif cookies:
+            cookie_store.update(cookies, persist=False)
+        self.cookie_store = cookie_store
+        self.headers = {**DEFAULT_HEADERS, **(headers or {})}
+        self.on_threat_defence = on_threat_defence
+        self.on_cookies = on_cookies
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2_available() if http2 is None else http2
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_threat_defence = max_threat_defence
+        self.scheduler = FetchScheduler() if scheduler is None else scheduler
+        self._client = None
+        self._client_generation = None  # cookie store generation the client's cookie jar was filled from
+        self._solving = None  # task of the threat defence solve in progress
+        self._loop_thread = None
+        self._lock = threading.Lock()
+
+    # == event loop plumbing ==
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop_thread is None:
+                self._loop_thread = LoopThread()
+            return self._loop_thread.loop
+
+    def submit(self, coro):
+        """schedule `coro` on the engine loop, returns a concurrent.futures.Future"""
+        self.loop  # make sure the loop thread is started
+        return self._loop_thread.submit(coro)
+
+    def run(self, coro):
+        """run `coro` on the engine loop and block until it is done (for sync callers)"""
+        return self.submit(coro).result()
+
+    async def arun(self, coro):
+        """await `coro` on the engine loop from any other event loop"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    # == fetching ==
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self._timeout(),
+                follow_redirects=True,
+            )
+        return self._client
+
+    @property
+    def cookies(self):
+        return self.cookie_store.get()
+
+    def set_cookies(self, cookies):
+        """replace the cookies in memory, the cookie store file is left as is"""
+        self.cookie_store.replace(cookies, persist=False)
+
+    def _sync_cookies(self, client):
+        generation = self.cookie_store.generation
+        if generation != self._client_generation:
+            client.cookies.clear()
+            client.cookies.update(self.cookie_store.get())
+            self._client_generation = generation
+        return generation
+
+    def _on_solved(self, task):
+        if self.on_cookies is not None and not task.cancelled() and task.exception() is None:
+            self.on_cookies(task.result())
+
+    async def _solve_threat_defence(self, url, generation):
+        """single-flight: while a solve is running, every other request hitting the defence page awaits it"""
+        if self._solving is None or self._solving.done():
+            self._solving = asyncio.ensure_future(
+                asyncio.to_thread(self.cookie_store.solve, url, self.on_threat_defence, generation)
+            )
+            self._solving.add_done_callback(self._on_solved)
+        # shielded so that one cancelled request doesn't abort the solve the others are waiting for
+        return await asyncio.shield(self._solving)
+
+    def _timeout(self, timeout=None):
+        read = self.timeout if timeout is None else timeout
+        return httpx.Timeout(read, connect=min(self.connect_timeout, read))
+
+    def _backoff(self, attempt, response=None):
+        """seconds before retry number `attempt`: the server's Retry-After, else full jitter exponential backoff"""
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        if retry_after.isdigit():
+            return min(self.max_backoff, int(retry_after))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    async def fetch(self, url, timeout=None, headers=None, retries=None, stream=False):
+        """
+        GET `url`, retrying transient failures and solving the threat defence page up to
+        `max_threat_defence` times. must run on the engine loop
+
+        :param timeout: seconds, overrides the engine read timeout for this request
+        :param headers: extra request headers, e.g. If-None-Match for a conditional request
+        :param retries: overrides the engine retries for this request, e.g. 0 when the caller fails over itself
+        :param stream: return as soon as the headers are in, with the body left unread. the caller iterates
+            `r.aiter_bytes()` and must `await r.aclose()`
+        """
+        client = self._get_client()
+        retries = self.retries if retries is None else retries
+        attempt = solves = 0
+        while True:
+            generation = self._sync_cookies(client)
+            r = None
+            try:
+                async with self.scheduler.slot(urlsplit(url).netloc) as slot:
+                    request = client.build_request('GET', url, headers=headers, timeout=self._timeout(timeout))
+                    r = await client.send(request, stream=stream)
+                    slot.done(r.status_code)
+            except RETRY_ERRORS as e:
+                if attempt >= retries:
+                    raise
+                error = str(e) or type(e).__name__
+            else:
+                if r.status_code in RETRY_STATUSES and attempt < retries:
+                    error = f'error {r.status_code}'
+                    await r.aclose()
+                elif not is_threat_defence(r.url):
+                    return r
+                else:
+                    logger.warning('defence detected at %s', r.url)
+                    if self.on_threat_defence is None:
+                        return r
+                    if solves >= self.max_threat_defence:
+                        logger.error('threat defence still up after %d solves, giving up on %s', solves, url)
+                        return r
+                    solves += 1
+                    await r.aclose()
+                    await self._solve_threat_defence(str(r.url), generation)
+                    continue
+            attempt += 1
+            delay = self._backoff(attempt, r)
+            logger.info('%s at %s, retry %d/%d in %.1fs', error, url, attempt, retries, delay)
+            await asyncio.sleep(delay)
+
+    async def probe(self, url, timeout=None):
+        """status code of a bare GET of `url`, without reading the body, following redirects or solving threat defence"""
+        client = self._get_client()
+        async with client.stream('GET', url, timeout=self._timeout(timeout), follow_redirects=False) as r:
+            return r.status_code
+
+    def fetch_sync(self, url):
+        return self.run(self.fetch(url))
+
+    async def fetch_many(self, urls):
+        """fetch all `urls` concurrently over the shared pool, exceptions are returned in place"""
+        return await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+
+    async def _aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def close(self):
+        with self._lock:
+            loop_thread, self._loop_thread = self._loop_thread, None
+        if loop_thread is None:
+            return
+        loop_thread.run(self._aclose())
+        loop_thread.stop()
@@ -0,0 +1,443 @@
+"""
+listing_parser - single pass parser for rarbg / torrentgalaxy listing pages
+
+Every `tr.lista2` row is visited once and all of its fields are read from the row's cells by
+position, instead of re-finding the parent row and running a CSS query per field. The row's
+link, image and data attributes are collected on the way for magnets.extract_infohash.
+The fastest installed backend is used: selectolax, then lxml, then BeautifulSoup (html.parser).
+ListingStreamParser parses a page from its raw bytes while it downloads, emitting each row as
+soon as its </tr> arrives.
+"""
+
+import codecs
+import datetime
+import logging
+import re
+from collections import namedtuple
+
+from .magnets import build_magnet, extract_infohash
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('selectolax', 'lxml', 'bs4')
+
+# typed fields of one listing row, `infohash` is '' when the row doesn't carry it
+ListingRow = namedtuple(
+    'ListingRow',
+    ['title', 'href', 'text', 'date', 'category_code', 'size', 'seeders', 'leechers', 'uploader', 'infohash'],
+)
+# attributes that may carry the infohash, besides data-*
+HINT_ATTRIBUTES = frozenset(('href', 'src', 'onmouseover'))
+
+size_units = {
+    'B': 1,
+    'KB': 10 ** 3,
+    'MB': 10 ** 6,
+    'GB': 10 ** 9,
+    'TB': 10 ** 12,
+    'PB': 10 ** 15,
+    'EB': 10 ** 18,
+    'ZB': 10 ** 21,
+    'YB': 10 ** 24,
+}
+
+CATEGORY_CODE_RE = re.compile(r'cat_new(\w+)\.gif')
+
+
+def parse_size(size: str):
+    number, unit = [string.strip() for string in size.strip().split()]
+    return int(float(number) * size_units[unit])
+
+
+def format_size(size: int, block_size=None):
+    """automatically format the size to the most appropriate unit"""
+    if block_size is None:
+        for unit in reversed(list(size_units.keys())):
+            if size >= size_units[unit]:
+                return f'{size / size_units[unit]:.2f} {unit}'
+    else:
+        return f'{size / size_units[block_size]:.2f} {block_size}'
+
+
+def parse_date(date: str):
+    return datetime.datetime.fromisoformat(date.strip()).timestamp()
+
+
+def parse_category_code(src: str):
+    match = CATEGORY_CODE_RE.search(src or '')
+    return match[1] if match else src.split('/')[-1].replace('cat_new', '').replace('.gif', '')
+
+
+def magnet_from_thumbnail(thumbnail, title):
+    # real:
+    #     https://rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
+    #     https://rarbgaccess.org/download.php?id=...&      f=...-[rarbg.com].torrent
+    # https://www.rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
+    # matches anything containing "over/<infohash>.jpg"
+    infohash = extract_infohash([('onmouseover', thumbnail or '')], 'rarbg')
+    return build_magnet(infohash, title) if infohash else ''
+
+
+def parse_total_pages(pager_texts):
+    """last pager link is the page count, or the third from last when it ends with next/last arrows"""
+    for text in (pager_texts[-1:] + pager_texts[-3:-2]):
+        try:
+            return int(text)
+        except ValueError:
+            continue
+    return None
+
+
+def _hints(attribute_dicts):
+    return [
+        (name, value)
+        for attributes in attribute_dicts
+        for name, value in attributes.items()
+        if value and (name in HINT_ATTRIBUTES or name.startswith('data-'))
+    ]
+
+
+def _build_row(anchor_attrs, anchor_text, cells, hints, provider):
+    date, img_src, size, seeders, leechers, uploader = cells
+    return ListingRow(
+        title=anchor_attrs.get('title'),
+        href=anchor_attrs.get('href'),
+        text=anchor_text,
+        date=parse_date(date),
+        category_code=parse_category_code(img_src),
+        size=parse_size(size),
+        seeders=int(seeders),
+        leechers=int(leechers),
+        uploader=uploader,
+        infohash=extract_infohash(hints, provider),
+    )
+
+
+def _is_torrent_anchor(attrs):
+    return (attrs.get('href') or '').startswith('/torrent/') and attrs.get('title') is not None
+
+
+def _utf8(html, encoding=None):
+    """`html` as the backends take it: str, or utf-8 bytes. other charsets are decoded, utf-8 bytes are kept as is"""
+    if isinstance(html, bytes) and encoding and codecs.lookup(encoding).name != 'utf-8':
+        return html.decode(encoding, errors='replace')
+    return html
+
+
+def _lxml_document(html):
+    import lxml.html
+
+    if isinstance(html, bytes):
+        # without a <meta charset>, lxml would read bytes as latin-1
+        return lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding='utf-8'))
+    return lxml.html.fromstring(html)
+
+
+# == backends ==
+# each returns (list of (anchor_attrs, anchor_text, cells, hints), pager_texts), made of plain strings only:
+# nothing returned may reference the parse tree, which is released as soon as the page is read
+
+
+def _rows_selectolax(html, table_offset):
+    try:
+        from selectolax.lexbor import LexborHTMLParser as HTMLParser
+    except ImportError:
+        from selectolax.parser import HTMLParser
+
+    tree = HTMLParser(html)
+    raw_rows = []
+    for tr in tree.css('tr.lista2'):
+        tds = list(tr.iter())
+        if len(tds) < 6 + table_offset:
+            continue
+        anchor = next((a for a in tr.css('a') if _is_torrent_anchor(a.attributes)), None)
+        if anchor is None:
+            continue
+        img = tds[table_offset].css_first('img')
+        font = tds[4 + table_offset].css_first('font')
+        cells = (
+            tds[2 + table_offset].text(strip=True),
+            img.attributes.get('src') if img is not None else '',
+            tds[3 + table_offset].text(strip=True),
+            font.text(strip=True) if font is not None else '',
+            tds[5 + table_offset].text(strip=True),
+            tds[-1].text(strip=True),
+        )
+        hints = _hints(node.attributes for node in tr.css('*'))
+        raw_rows.append((anchor.attributes, anchor.text(strip=False), cells, hints))
+    pager_texts = [a.text(strip=True) for a in tree.css('#pager_links > a')]
+    return raw_rows, pager_texts
+
+
+def _row_lxml(tr, table_offset):
+    """(anchor_attrs, anchor_text, cells, hints) of one lxml `tr` element, None when it isn't a torrent row"""
+    tds = [child for child in tr if isinstance(child.tag, str)]
+    if len(tds) < 6 + table_offset:
+        return None
+    anchor = next((a for a in tr.iter('a') if _is_torrent_anchor(a.attrib)), None)
+    if anchor is None:
+        return None
+    img = next(tds[table_offset].iter('img'), None)
+    font = next(tds[4 + table_offset].iter('font'), None)
+    cells = (
+        tds[2 + table_offset].text_content().strip(),
+        img.get('src', '') if img is not None else '',
+        tds[3 + table_offset].text_content().strip(),
+        font.text_content().strip() if font is not None else '',
+        tds[5 + table_offset].text_content().strip(),
+        tds[-1].text_content().strip(),
+    )
+    hints = _hints(element.attrib for element in tr.iter() if isinstance(element.tag, str))
+    return dict(anchor.attrib), anchor.text_content(), cells, hints
+
+
+def _rows_lxml(html, table_offset):
+    doc = _lxml_document(html)
+    raw_rows = []
+    for tr in doc.xpath('//tr[contains(concat(" ", normalize-space(@class), " "), " lista2 ")]'):
+        raw_row = _row_lxml(tr, table_offset)
+        if raw_row is not None:
+            raw_rows.append(raw_row)
+    pager_texts = [a.text_content().strip() for a in doc.xpath('//*[@id="pager_links"]/a')]
+    return raw_rows, pager_texts
+
+
+def _rows_bs4(html, table_offset):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        return _read_rows_bs4(soup, table_offset)
+    finally:
+        # the tree is full of parent / sibling reference cycles, break them instead of waiting for the gc
+        soup.decompose()
+
+
+def _read_rows_bs4(soup, table_offset):
+    raw_rows = []
+    for tr in soup.select('tr.lista2'):
+        tds = tr.find_all(recursive=False)
+        if len(tds) < 6 + table_offset:
+            continue
+        anchor = next((a for a in tr.find_all('a') if _is_torrent_anchor(a.attrs)), None)
+        if anchor is None:
+            continue
+        img = tds[table_offset].find('img')
+        font = tds[4 + table_offset].find('font')
+        cells = (
+            tds[2 + table_offset].get_text(strip=True),
+            img.get('src', '') if img is not None else '',
+            tds[3 + table_offset].get_text(strip=True),
+            font.get_text(strip=True) if font is not None else '',
+            tds[5 + table_offset].get_text(strip=True),
+            tds[-1].get_text(strip=True),
+        )
+        hints = _hints(tag.attrs for tag in [tr, *tr.find_all(True)])
+        raw_rows.append((dict(anchor.attrs), anchor.get_text(), cells, hints))
+    pager_texts = [a.get_text(strip=True) for a in soup.select('#pager_links > a')]
+    return raw_rows, pager_texts
+
+
+_BACKEND_FUNCS = {
+    'selectolax': _rows_selectolax,
+    'lxml': _rows_lxml,
+    'bs4': _rows_bs4,
+}
+_BACKEND_MODULES = {
+    'selectolax': 'selectolax',
+    'lxml': 'lxml.html',
+    'bs4': 'bs4',
+}
+
+
+def available_backends():
+    import importlib
+
+    available = []
+    for name in BACKENDS:
+        try:
+            importlib.import_module(_BACKEND_MODULES[name])
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+_default_backend = None
+
+
+def get_backend(name=None):
+    """name of the backend to use, defaults to the fastest one installed"""
+    global _default_backend
+    if name is not None:
+        if name not in _BACKEND_FUNCS:
+            raise ValueError(f'unknown parser backend {name!r}, choose from {BACKENDS}')
+        return name
+    if _default_backend is None:
+        _default_backend = (available_backends() or ['bs4'])[0]
+    return _default_backend
+
+
+def parse_listing(html, table_offset=0, backend=None, provider=None, encoding=None):
+    """
+    parse a listing page into rows
+
+    :param html: page body, bytes (parsed without decoding them to str first) or str
+    :param table_offset: 1 for torrentgalaxy mirrors (extra leading column), 0 for rarbg
+    :param provider: 'rarbg' or 'torrentgalaxy' infohash extraction, guessed from `table_offset` by default
+    :param encoding: charset of `html` when it is bytes, utf-8 by default
+    :return: (list of ListingRow, total pages or None)
+    """
+    provider = provider or ('torrentgalaxy' if table_offset else 'rarbg')
+    raw_rows, pager_texts = _BACKEND_FUNCS[get_backend(backend)](_utf8(html, encoding), table_offset)
+    return _build_rows(raw_rows, provider), parse_total_pages(pager_texts)
+
+
+def _build_rows(raw_rows, provider):
+    rows = []
+    for anchor_attrs, anchor_text, cells, hints in raw_rows:
+        try:
+            rows.append(_build_row(anchor_attrs, anchor_text, cells, hints, provider))
+        except (ValueError, KeyError) as e:
+            logger.debug('skipping malformed row %r: %s', anchor_attrs.get('href'), e)
+    return rows
+
+
+def stream_parsing_available():
+    try:
+        import lxml.html  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ListingStreamParser:
+    """
+    incremental listing page parser, fed the raw body chunk by chunk:
+
+        parser = ListingStreamParser(encoding=response.charset_encoding)
+        async for chunk in response.aiter_bytes():
+            for row in parser.feed(chunk):
+                ...
+        rows = parser.close()
+        parser.total_pages
+
+    the bytes go straight to lxml's HTML tokenizer, without being decoded to str first. finished rows are
+    dropped from the tree, so only the row being received is held in memory. without lxml, the chunks are
+    buffered and the page is parsed by `parse_listing` on `close`
+
+    :param encoding: charset of the body, utf-8 by default
+    """
+
+    def __init__(self, table_offset=0, provider=None, encoding=None, backend=None):
+        self.table_offset = table_offset
+        self.provider = provider or ('torrentgalaxy' if table_offset else 'rarbg')
+        self.backend = backend
+        self.encoding = encoding
+        self.total_pages = None
+        self._pager_texts = []
+        if stream_parsing_available():
+            import lxml.etree
+            import lxml.html
+
+            self._parser = lxml.etree.HTMLPullParser(events=('end',), tag=('tr', 'a'), encoding=encoding or 'utf-8')
+            # lxml.html elements, for text_content() as in the lxml backend
+            self._parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+            self._chunks = None
+        else:
+            self._parser = None
+            self._chunks = []
+
+    def _read_events(self):
+        raw_rows = []
+        for _, element in self._parser.read_events():
+            if element.tag == 'a':
+                parent = element.getparent()
+                if parent is not None and parent.get('id') == 'pager_links':
+                    self._pager_texts.append(element.text_content().strip())
+                continue
+            if 'lista2' in (element.get('class') or '').split():
+                raw_row = _row_lxml(element, self.table_offset)
+                if raw_row is not None:
+                    raw_rows.append(raw_row)
+            # this row is read, it and every row before it can go
+            element.clear()
+            parent = element.getparent()
+            while parent is not None and element.getprevious() is not None:
+                del parent[0]
+        return _build_rows(raw_rows, self.provider)
+
+    def feed(self, chunk):
+        """the rows completed by `chunk` (bytes)"""
+        if self._parser is None:
+            self._chunks.append(chunk)
+            return []
+        self._parser.feed(chunk)
+        return self._read_events()
+
+    def close(self):
+        """the remaining rows, once the whole body was fed. sets `total_pages`"""
+        if self._parser is None:
+            rows, self.total_pages = parse_listing(
+                b''.join(self._chunks), self.table_offset, self.backend, self.provider, self.encoding
+            )
+            return rows
+        self._parser.close()
+        rows = self._read_events()
+        self.total_pages = parse_total_pages(self._pager_texts)
+        return rows
+
+
+# == detail pages ==
+
+
+def _detail_selectolax(html):
+    try:
+        from selectolax.lexbor import LexborHTMLParser as HTMLParser
+    except ImportError:
+        from selectolax.parser import HTMLParser
+
+    tree = HTMLParser(html)
+    magnet = tree.css_first('a[href^="magnet:"]')
+    torrent_file = tree.css_first('a[href^="/download.php"]')
+    return (
+        magnet.attributes.get('href') if magnet is not None else '',
+        torrent_file.attributes.get('href') if torrent_file is not None else '',
+    )
+
+
+def _detail_lxml(html):
+    doc = _lxml_document(html)
+    # xpath strings are "smart" by default: they keep a reference to their element, and so to the whole tree
+    magnet = doc.xpath('//a[starts-with(@href, "magnet:")]/@href', smart_strings=False)
+    torrent_file = doc.xpath('//a[starts-with(@href, "/download.php")]/@href', smart_strings=False)
+    return (magnet[0] if magnet else ''), (torrent_file[0] if torrent_file else '')
+
+
+def _detail_bs4(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    magnet = soup.select_one('a[href^="magnet:"]')
+    torrent_file = soup.select_one('a[href^="/download.php"]')
+    links = (
+        magnet.get('href') if magnet is not None else '',
+        torrent_file.get('href') if torrent_file is not None else '',
+    )
+    soup.decompose()
+    return links
+
+
+_DETAIL_FUNCS = {
+    'selectolax': _detail_selectolax,
+    'lxml': _detail_lxml,
+    'bs4': _detail_bs4,
+}
+
+
+def parse_detail(html, backend=None, encoding=None):
+    """
+    :param encoding: charset of `html` when it is bytes, utf-8 by default
+    :return: (magnet link, torrent file href) of a torrent detail page, empty strings when missing
+    """
+    return _DETAIL_FUNCS[get_backend(backend)](_utf8(html, encoding))
@@ -0,0 +1,172 @@
+"""
+local_index - offline full-text index of every torrent row ever scraped
+
+TorrentIndex keeps one row per detail page (title, infohash, size, seeders, date, category, ...)
+in SQLite, with an FTS5 index over the titles, and is upserted from every listing page the search
+client parses. `search` answers a query from it without any network request; rows not seen
+within `max_age` seconds are ignored so stale seeder counts don't win.
+Falls back to LIKE matching when the sqlite library was built without FTS5.
+"""
+
+import logging
+import re
+import sqlite3
+import time
+
+from .records import TorrentRecord
+from .search_cache import SqliteStore, normalize_query
+from .topk import ORDER2SORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 24 * 60 * 60
+COLUMNS = ('href', 'infohash', 'title', 'torrent', 'date', 'category', 'size', 'seeders', 'leechers', 'uploader',
+           'magnet', 'torrent_file', 'seen')
+SORT_COLUMNS = ('title', 'date', 'size', 'seeders', 'leechers')
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+class TorrentIndex(SqliteStore):
+    """
+    :param path: sqlite database file, ':memory:' for a process local index
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.fts = fts5_available()
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS torrents ('
+            ' href TEXT PRIMARY KEY,'
+            ' infohash TEXT,'
+            ' title TEXT NOT NULL,'
+            ' torrent TEXT,'
+            ' date REAL,'
+            ' category TEXT,'
+            ' size INTEGER,'
+            ' seeders INTEGER,'
+            ' leechers INTEGER,'
+            ' uploader TEXT,'
+            ' magnet TEXT,'
+            ' torrent_file TEXT,'
+            ' seen REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS torrents_infohash ON torrents (infohash)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS torrents_seen ON torrents (seen)')
+        if self.fts:
+            # external content table: the titles are stored once, in `torrents`, and kept in sync by triggers
+            self._conn.executescript(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS torrents_fts USING fts5(title, content='torrents', content_rowid='rowid');"
+                'CREATE TRIGGER IF NOT EXISTS torrents_ai AFTER INSERT ON torrents BEGIN'
+                ' INSERT INTO torrents_fts (rowid, title) VALUES (new.rowid, new.title); END;'
+                'CREATE TRIGGER IF NOT EXISTS torrents_ad AFTER DELETE ON torrents BEGIN'
+                " INSERT INTO torrents_fts (torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title); END;"
+                'CREATE TRIGGER IF NOT EXISTS torrents_au AFTER UPDATE OF title ON torrents BEGIN'
+                " INSERT INTO torrents_fts (torrents_fts, rowid, title) VALUES ('delete', old.rowid, old.title);"
+                ' INSERT INTO torrents_fts (rowid, title) VALUES (new.rowid, new.title); END;'
+            )
+
+    def add(self, records, seen=None):
+        """upsert scraped records: counts are overwritten, magnet links are only ever filled in"""
+        seen = time.time() if seen is None else seen
+        rows = [
+            (
+                record.href, record.infohash or None, record.title, record.torrent, record.date, record.category,
+                record.size, record.seeders, record.leechers, record.uploader, record.magnet or None,
+                record.torrent_file, seen,
+            )
+            for record in records
+            if record.href and record.title
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    f'INSERT INTO torrents ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})'
+                    ' ON CONFLICT (href) DO UPDATE SET'
+                    ' infohash = COALESCE(excluded.infohash, infohash),'
+                    ' title = excluded.title,'
+                    ' date = excluded.date,'
+                    ' category = excluded.category,'
+                    ' size = excluded.size,'
+                    ' seeders = excluded.seeders,'
+                    ' leechers = excluded.leechers,'
+                    ' magnet = COALESCE(excluded.magnet, magnet),'
+                    ' torrent_file = COALESCE(excluded.torrent_file, torrent_file),'
+                    ' seen = excluded.seen',
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def search(self, query, category='', order='', limit=float('inf'), sort='', max_age=DEFAULT_MAX_AGE):
+        """
+        records whose title contains every word of `query`, seen within `max_age` seconds (None for any age).
+        ordered by `sort`, else by `order` (as the mirror would), else by relevance
+        """
+        tokens = TOKEN_RE.findall(normalize_query(query))
+        if not tokens:
+            return []
+        where, params = [], []
+        if self.fts:
+            source = 'torrents_fts JOIN torrents ON torrents.rowid = torrents_fts.rowid'
+            where.append('torrents_fts MATCH ?')
+            params.append(' '.join('"%s"' % token for token in tokens))
+            relevance = 'torrents_fts.rank'
+        else:
+            source = 'torrents'
+            for token in tokens:
+                where.append("title LIKE ? ESCAPE '\\'")
+                params.append('%' + token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+            relevance = 'torrents.seen DESC'
+        if max_age is not None:
+            where.append('torrents.seen >= ?')
+            params.append(time.time() - max_age)
+        if category == 'nonxxx':
+            where.append("torrents.category != 'xxx'")
+        elif category:
+            where.append('torrents.category = ?')
+            params.append(category)
+
+        sort = sort or ORDER2SORT.get(order, '')
+        order_by = f'torrents.{sort} DESC' if sort in SORT_COLUMNS else relevance
+        sql = f'SELECT {", ".join("torrents." + c for c in COLUMNS)} FROM {source} WHERE {" AND ".join(where)}'
+        sql += f' ORDER BY {order_by}'
+        if limit < float('inf'):
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._record(row) for row in rows]
+
+    @staticmethod
+    def _record(row):
+        d = dict(zip(COLUMNS, row))
+        return TorrentRecord(
+            title=d['title'],
+            href=d['href'],
+            torrent=d['torrent'] or '',
+            date=d['date'] or 0.0,
+            category=d['category'] or 'UNKOWN',
+            size=d['size'] or 0,
+            seeders=d['seeders'] or 0,
+            leechers=d['leechers'] or 0,
+            uploader=d['uploader'] or '',
+            magnet=d['magnet'] or '',
+            torrent_file=d['torrent_file'],
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM torrents').fetchone()[0]
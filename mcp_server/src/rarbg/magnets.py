@@ -0,0 +1,74 @@
+"""
+magnets - infohash extraction from listing rows and magnet link synthesis
+
+A listing row usually carries its torrent's infohash somewhere: in the rarbg thumbnail popup, a
+magnet or torrent cache link, a download link parameter or a data attribute. `extract_infohash`
+looks for it in the row's attributes with precompiled patterns, tried in a per provider order,
+and `build_magnet` turns it into a magnet link, so the row needs no detail page request.
+"""
+
+import base64
+import binascii
+import re
+from urllib.parse import quote
+
+from .settings import MAGNET_TRACKERS
+
+_HASH = r'([0-9A-Fa-f]{40}|[A-Za-z2-7]{32})'
+
+# (attribute kind, pattern), the infohash is the first group
+THUMBNAIL_PATTERNS = (
+    ('onmouseover', re.compile(r'over/' + _HASH + r'\.jpg')),
+    ('src', re.compile(r'over/' + _HASH + r'\.jpg')),
+)
+LINK_PATTERNS = (
+    ('href', re.compile(r'urn:btih:' + _HASH, re.IGNORECASE)),
+    ('href', re.compile(r'/torrent/' + _HASH + r'\.torrent')),  # itorrents / torrage style cache links
+    ('href', re.compile(r'[?&](?:h|hash|info_hash)=' + _HASH + r'(?:&|$)')),
+    ('data', re.compile(r'^' + _HASH + r'$')),
+)
+PROVIDER_PATTERNS = {
+    'rarbg': THUMBNAIL_PATTERNS + LINK_PATTERNS,
+    'torrentgalaxy': LINK_PATTERNS + THUMBNAIL_PATTERNS,
+}
+
+
+def normalize_infohash(infohash):
+    """upper case hex, base32 infohashes (32 characters) are converted to hex"""
+    infohash = (infohash or '').strip()
+    if len(infohash) == 32:
+        try:
+            return base64.b32decode(infohash.upper()).hex().upper()
+        except (binascii.Error, ValueError):
+            pass
+    return infohash.upper()
+
+
+def attribute_kind(name):
+    return 'data' if name.startswith('data-') else name
+
+
+def extract_infohash(attributes, provider='rarbg'):
+    """
+    :param attributes: (name, value) pairs of the row's elements, e.g. ('href', '/download.php?...')
+    :param provider: 'rarbg' or 'torrentgalaxy', picks the order patterns are tried in
+    :return: normalized infohash, '' when the row doesn't carry one
+    """
+    values = {}
+    for name, value in attributes:
+        if value:
+            values.setdefault(attribute_kind(name), []).append(value)
+    for kind, pattern in PROVIDER_PATTERNS.get(provider, LINK_PATTERNS):
+        for value in values.get(kind, ()):
+            match = pattern.search(value)
+            if match:
+                return normalize_infohash(match[1])
+    return ''
+
+
+def build_magnet(infohash, title, trackers=None):
+    """magnet link of `infohash` named `title`, announcing to `trackers` (settings.MAGNET_TRACKERS by default)"""
+    trackers = MAGNET_TRACKERS if trackers is None else trackers
+    return f'magnet:?xt=urn:btih:{infohash}&dn={quote(title)}' + ''.join(
+        '&tr=' + quote(tracker, safe='') for tracker in trackers
+    )
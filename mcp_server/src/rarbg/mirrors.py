@@ -0,0 +1,134 @@
+"""
+mirrors - latency / health tracking of the torrentgalaxy mirrors
+
+MirrorManager keeps an exponentially weighted latency and error rate per mirror, fed both by a
+periodic background probe and by the real searches, and ranks mirrors by them. The search client
+uses it to route each search to the fastest healthy mirror and to fail over to the next one when
+a mirror times out or errors in the middle of a query.
+"""
+
+import asyncio
+import logging
+import time
+
+import httpx
+
+from .settings import TORRENTGALAXY_DOMAINS
+
+logger = logging.getLogger(__name__)
+
+# errors that mean the mirror, not the request, is at fault
+MIRROR_ERRORS = (httpx.TimeoutException, httpx.TransportError)
+
+
+def _normalize(domain):
+    for scheme in ('https://', 'http://'):
+        if domain.startswith(scheme):
+            domain = domain[len(scheme):]
+    return domain.strip().rstrip('/')
+
+
+class MirrorStats:
+    __slots__ = ('latency', 'error_rate', 'checked')
+
+    def __init__(self):
+        self.latency = None  # seconds, None until the first success
+        self.error_rate = 0.0
+        self.checked = 0.0
+
+
+class MirrorManager:
+    """
+    :param domains: mirrors to choose from, in order of preference when nothing is known about them yet
+    :param timeout: per request timeout used for listing pages, a mirror slower than this is failed over
+    :param probe_interval: seconds between background probes, see `start`
+    :param alpha: weight of the newest observation in the moving averages
+    """
+
+    def __init__(self, domains=TORRENTGALAXY_DOMAINS, timeout=10.0, probe_interval=300.0, probe_timeout=5.0,
+                 alpha=0.3):
+        self.domains = list(dict.fromkeys(_normalize(domain) for domain in domains))
+        self.timeout = timeout
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.alpha = alpha
+        self.stats = {domain: MirrorStats() for domain in self.domains}
+        self._probe_future = None
+
+    # == observations ==
+
+    def record_success(self, domain, latency):
+        stats = self.stats.setdefault(_normalize(domain), MirrorStats())
+        stats.latency = latency if stats.latency is None else self.alpha * latency + (1 - self.alpha) * stats.latency
+        stats.error_rate *= 1 - self.alpha
+        stats.checked = time.time()
+
+    def record_failure(self, domain):
+        stats = self.stats.setdefault(_normalize(domain), MirrorStats())
+        stats.error_rate = self.alpha + (1 - self.alpha) * stats.error_rate
+        stats.checked = time.time()
+
+    # == ranking ==
+
+    def score(self, domain):
+        """expected cost of a request to `domain`, lower is better"""
+        stats = self.stats[domain]
+        latency = self.timeout / 2 if stats.latency is None else stats.latency
+        return latency + stats.error_rate * self.timeout
+
+    def healthy(self, domain):
+        return self.stats[domain].error_rate < 0.5
+
+    def ranked(self, exclude=()):
+        """mirrors best first, unhealthy ones last"""
+        candidates = [domain for domain in self.domains if domain not in exclude]
+        return sorted(candidates, key=lambda domain: (not self.healthy(domain), self.score(domain)))
+
+    def best(self, exclude=()):
+        ranked = self.ranked(exclude)
+        return ranked[0] if ranked else None
+
+    # == probing ==
+
+    async def probe(self, engine):
+        """measure every mirror once, concurrently. must run on the engine loop"""
+
+        async def probe_one(domain):
+            start = time.monotonic()
+            try:
+                status = await engine.probe(f'https://{domain}/', timeout=self.probe_timeout)
+            except MIRROR_ERRORS as e:
+                logger.debug('mirror %s probe failed: %s', domain, e)
+                self.record_failure(domain)
+                return
+            except Exception:
+                # anything else (e.g. a bad response) must not end the probing of the other mirrors
+                logger.warning('mirror %s probe raised', domain, exc_info=True)
+                self.record_failure(domain)
+                return
+            if status >= 500:
+                self.record_failure(domain)
+            else:
+                self.record_success(domain, time.monotonic() - start)
+
+        await asyncio.gather(*map(probe_one, self.domains))
+        logger.debug('mirror ranking: %s', self.ranked())
+
+    async def _probe_forever(self, engine):
+        while True:
+            try:
+                await self.probe(engine)
+            except Exception:
+                # the ranking would silently go stale if this loop ended
+                logger.exception('mirror probing failed, retrying in %ss', self.probe_interval)
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self, engine):
+        """probe the mirrors in the background on the engine loop, every `probe_interval` seconds"""
+        if self._probe_future is None or self._probe_future.done():
+            self._probe_future = engine.submit(self._probe_forever(engine))
+
+    def stop(self):
+        if self._probe_future is not None:
+            self._probe_future.cancel()
+            self._probe_future = None
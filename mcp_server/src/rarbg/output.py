@@ -0,0 +1,62 @@
+"""
+output - compact, streamable serialization of search records
+
+`dumps` is orjson when installed and the stdlib json (without indentation) otherwise.
+NdjsonWriter writes one JSON object per line and flushes it right away, so a pipe downstream
+can act on the first results while the search is still running.
+"""
+
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OUTPUT_FORMATS = ('json', 'ndjson')
+
+
+def dumps(obj):
+    """compact JSON text of `obj`"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def parse_fields(fields):
+    """'title,magnet,size' -> ('title', 'magnet', 'size'), None or '' for every field"""
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return tuple(field.strip() for field in fields if field.strip())
+
+
+def project(d, fields):
+    """`d` restricted to `fields`, in that order"""
+    if fields is None:
+        return d
+    return {field: d[field] for field in fields if field in d}
+
+
+class NdjsonWriter:
+    """
+    :param stream: text stream to write to, stdout by default
+    :param fields: fields to keep, see `parse_fields`
+    :param block_size: unit the sizes are formatted in, see TorrentRecord.to_dict
+    """
+
+    def __init__(self, stream=None, fields=None, block_size=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.fields = parse_fields(fields)
+        self.block_size = block_size
+        self.count = 0
+
+    def write(self, record):
+        self.write_dict(record.to_dict(self.block_size))
+
+    def write_dict(self, d):
+        self.stream.write(dumps(project(d, self.fields)) + '\n')
+        self.stream.flush()
+        self.count += 1
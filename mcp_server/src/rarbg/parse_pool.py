@@ -0,0 +1,84 @@
+"""
+parse_pool - optional multi-process parse stage for listing and detail pages
+
+Parsing is CPU bound and, on the engine loop, runs under the GIL between fetches. ParsePool hands
+the raw response bytes to a pool of worker processes, which parse them with listing_parser and send
+back plain row tuples (cheap to pickle), so multi-page scrapes and batch searches parse on every
+core while the engine keeps fetching. Workers are spawned once, on first use, and kept.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .listing_parser import ListingRow, parse_detail, parse_listing
+
+
+def _parse_listing(content, table_offset, backend, provider, encoding=None):
+    rows, total_pages = parse_listing(content, table_offset, backend, provider, encoding)
+    return [tuple(row) for row in rows], total_pages
+
+
+def _parse_listing_args(args):
+    return _parse_listing(*args)
+
+
+class ParsePool:
+    """
+    :param workers: parser processes, os.cpu_count() by default
+    :param backend: one of listing_parser.BACKENDS the workers parse with, the fastest installed one by default
+    """
+
+    def __init__(self, workers=None, backend=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = backend
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawned, not forked: the parent runs the engine loop thread, which a fork would copy mid-flight
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    async def parse_listing(self, content, table_offset=0, provider=None, encoding=None):
+        """
+        listing_parser.parse_listing in a worker process, `content` is the raw page body and `encoding`
+        its charset (e.g. the response's charset_encoding), None to detect it
+        """
+        rows, total_pages = await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), _parse_listing, content, table_offset, self.backend, provider, encoding
+        )
+        return [ListingRow._make(row) for row in rows], total_pages
+
+    async def parse_detail(self, content, encoding=None):
+        """listing_parser.parse_detail in a worker process"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), parse_detail, content, self.backend, encoding
+        )
+
+    def parse_listings(self, contents, table_offset=0, provider=None, chunksize=4, encoding=None):
+        """
+        blocking, ordered parse of many page bodies (e.g. saved snapshots) across the workers,
+        returns a (rows, total pages) pair per page
+        """
+        args = ((content, table_offset, self.backend, provider, encoding) for content in contents)
+        return [
+            ([ListingRow._make(row) for row in rows], total_pages)
+            for rows, total_pages in self._get_executor().map(_parse_listing_args, args, chunksize=chunksize)
+        ]
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
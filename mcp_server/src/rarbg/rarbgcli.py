@@ -9,259 +9,171 @@ Example usage:
 https://github.com/FarisHijazi/rarbgcli
 
 """
-# TODO: turn this lib into an API lib (keep the CLI as a bonus)
-
 import argparse
 import asyncio
-import concurrent.futures
-import datetime
+import atexit
 import json
 import os
-import re
 import sys
 import time
-import traceback
 import warnings
 import webbrowser
-import zipfile
+from collections import deque
 from functools import partial
-from http.cookies import SimpleCookie
-from pathlib import Path
-from sys import platform
-
-import requests
-import wget
-from bs4 import BeautifulSoup
-from requests.utils import quote
+
 from tqdm import tqdm
 
+from .client import RarbgSearchClient, build_url, normalize_domain, topk_slack, torrent_file_url  # noqa: F401
+from .cookie_store import CookieStore
+from .http_engine import FetchEngine
+from .listing_parser import format_size, magnet_from_thumbnail, parse_size, size_units  # noqa: F401
+from .local_index import TorrentIndex
+from .mirrors import MirrorManager
+from .output import OUTPUT_FORMATS, NdjsonWriter, parse_fields, project
+from .parse_pool import ParsePool
+from .record_index import RecordIndex
+from .scheduler import DEFAULT_MAX_PER_DOMAIN
+from .search_cache import DEFAULT_TTL, MagnetCache, QueryCache
+from .settings import (  # noqa: F401
+    CATEGORY2CODE,
+    CODE2CATEGORY,
+    COOKIES_PATH,
+    HOME_DIRECTORY,
+    MAGNET_CACHE_PATH,
+    PROGRAM_HOME,
+    QUERY_CACHE_PATH,
+    TORRENTGALAXY_CATEGORY2CODE,
+    TORRENTGALAXY_DOMAINS,
+    TORRENT_INDEX_PATH,
+    WATCH_DB_PATH,
+)
+from .snapshots import DEFAULT_MAX_BYTES, SnapshotWriter
+from .table import sorted_records
+from .threat_defence import (  # noqa: F401
+    cookies_dict_to_txt,
+    cookies_txt_to_dict,
+    deal_with_threat_defence,
+    deal_with_threat_defence_manual,
+    download_tesseract,
+    solveCaptcha,
+)
+from .topk import TopK, server_ordered
+from .watch import DEFAULT_INTERVAL, Watcher, WatchStore
+
 real_print = print
 print = print if sys.stdout.isatty() else partial(print, file=sys.stderr)
 
-HOME_DIRECTORY = os.environ.get('RARBGCLI_HOME', str(Path.home()))
-PROGRAM_HOME = os.path.join(HOME_DIRECTORY, '.rarbgcli')
-os.makedirs(PROGRAM_HOME, exist_ok=True)
-COOKIES_PATH = os.path.join(PROGRAM_HOME, 'cookies.json')
-
-TORRENTGALAXY_DOMAINS = [
-    'https://rargb.to',
-    'https://www.rarbggo.to',
-    'https://www.rarbgproxy.to',
-    'https://www.rarbgo.to',
-    'https://www.proxyrarbg.to',
-    'https://rarbg.tw',
-    'https://rarbgprx.org',
-    'https://rarbgunblock.com',
-    'https://rarbgmirror.com',
-    'https://rarbgunblock.com',
-]
-TORRENTGALAXY_CATEGORY2CODE = {
-    'movies': 'movies',
-    'xxx': 'xxx',
-    'music': 'music',
-    'tvshows': 'tvshows',
-    'software': 'software',
-    'games': 'games',
-    'nonxxx': 'nonxxx',
-}
-CATEGORY2CODE = {
-    'movies': '48;17;44;45;47;50;51;52;42;46'.split(';'),
-    'xxx': '4'.split(';'),
-    'music': '23;24;25;26'.split(';'),
-    'tvshows': '18;41;49'.split(';'),
-    'software': '33;34;43'.split(';'),
-    'games': '27;28;29;30;31;32;40;53'.split(';'),
-    'nonxxx': '2;14;15;16;17;21;22;42;18;19;41;27;28;29;30;31;32;40;23;24;25;26;33;34;43;44;45;46;47;48;49;50;51;52;54'.split(
-        ';'),
-    '': '',
-}
-CODE2CATEGORY = {}
-for category, codes in CATEGORY2CODE.items():
-    if category in ['movies', 'xxx', 'music', 'tvshows', 'software']:
-        for code in codes:
-            CODE2CATEGORY[code] = category
-
-
-# Captcha solving taken from https://github.com/confident-hate/seedr-cli
-
-
-def solveCaptcha(threat_defence_url):
-    from io import BytesIO
-
-    import pytesseract
-    from PIL import Image
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.common.keys import Keys
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.webdriver.support.ui import WebDriverWait
-    from webdriver_manager.chrome import ChromeDriverManager
-
-    def img2txt():
-        try:
-            clk_here_button = driver.find_element_by_link_text('Click here')
-            clk_here_button.click()
-            time.sleep(10)
-            WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.ID, 'solve_string')))
-        except Exception:
-            pass
-        finally:
-            element = driver.find_elements_by_css_selector('img')[1]
-            location = element.location
-            size = element.size
-            png = driver.get_screenshot_as_png()
-            x = location['x']
-            y = location['y']
-            width = location['x'] + size['width']
-            height = location['y'] + size['height']
-            im = Image.open(BytesIO(png))
-            im = im.crop((int(x), int(y), int(width), int(height)))
-            return pytesseract.image_to_string(im)
-
-    options = Options()
-    options.add_argument('--no-sandbox')
-    options.add_argument('--headless')
-    options.add_argument('--log-level=3')
-    options.add_argument('--disable-logging')
-    options.add_argument('--output=' + ('NUL' if sys.platform == 'win32' else '/dev/null'))
-
-    # import get_chrome_driver  # no longer needed since ChromeDriverManager exists
-    # chromedriver_path = get_chrome_driver.main(PROGRAM_HOME)
-    driver = webdriver.Chrome(
-        ChromeDriverManager(path=PROGRAM_HOME).install(),
-        chrome_options=options,
-        service_log_path=('NUL' if sys.platform == 'win32' else '/dev/null'),
-    )
-    print('successfully loaded chrome driver')
 
-    driver.implicitly_wait(10)
-    driver.get(threat_defence_url)
+_cookie_store = None
 
-    if platform == 'win32':
-        pytesseract.pytesseract.tesseract_cmd = os.path.join(PROGRAM_HOME, 'Tesseract-OCR', 'tesseract')
 
-    try:
-        solution = img2txt()
-    except pytesseract.TesseractNotFoundError:
-        print('Tesseract not found. Downloading tesseract ...')
-        download_tesseract(PROGRAM_HOME)
-        solution = img2txt()
-
-    text_field = driver.find_element_by_id('solve_string')
-    text_field.send_keys(solution)
-    try:
-        text_field.send_keys(Keys.RETURN)
-    except Exception as e:
-        print(e)
-
-    time.sleep(3)
-    cookies = {c['name']: c['value'] for c in (driver.get_cookies())}
-    driver.close()
-    return cookies
-
-
-def download_tesseract(chdir='.'):
-    os.chdir(chdir)
-
-    # download for each platform if statement
-    if platform == 'win32':
-        tesseract_zip = wget.download(
-            'https://github.com/FarisHijazi/rarbgcli/releases/download/v0.0.7/Tesseract-OCR.zip', 'Tesseract-OCR.zip')
-        # extract the zip file
-        with zipfile.ZipFile(tesseract_zip, 'r') as zip_ref:
-            zip_ref.extractall()  # you can specify the destination folder path here
-        # delete the zip file downloaded above
-        os.remove(tesseract_zip)
-    elif platform in ['linux', 'linux2']:
-        os.system('sudo apt-get install tesseract-ocr')
-    else:
-        raise Exception('Unsupported platform')
+def get_cookie_store():
+    """cookies.json, read once and kept in memory, written atomically only when the cookies change"""
+    global _cookie_store
+    if _cookie_store is None:
+        _cookie_store = CookieStore(COOKIES_PATH)
+    return _cookie_store
 
 
-def cookies_txt_to_dict(cookies_txt: str) -> dict:
-    # SimpleCookie.load = lambda self, data: self.__init__(data.split(';'))
-    cookie = SimpleCookie()
-    cookie.load(cookies_txt)
-    return {k: v.value for k, v in cookie.items()}
+_engine = None
 
 
-def cookies_dict_to_txt(cookies_dict: dict) -> str:
-    return '; '.join(f'{k}={v}' for k, v in cookies_dict.items())
+def get_engine():
+    """the process wide fetch engine, its connection pool is shared by every search"""
+    global _engine
+    if _engine is None:
+        _engine = FetchEngine(on_threat_defence=deal_with_threat_defence, cookie_store=get_cookie_store())
+    return _engine
 
 
-def deal_with_threat_defence_manual(threat_defence_url):
-    real_print(
-        f"""
-    rarbg CAPTCHA must be solved, please follow the instructions bellow (only needs to be done once in a while):
+_query_cache = None
 
-    1. On any PC, open the link in a web browser: "{threat_defence_url}"
-    2. solve and submit the CAPTCHA you should be redirected to a torrent page
-    3. open the console (press F12 -> Console) and paste the following code:
 
-        console.log(document.cookie)
+def get_query_cache(ttl=DEFAULT_TTL):
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryCache(QUERY_CACHE_PATH, ttl=ttl)
+    _query_cache.ttl = ttl
+    return _query_cache
 
-    4. copy the output. it will look something like: "tcc; gaDts48g=q8hppt; gaDts48g=q85p9t; ...."
-    5. paste the output in the terminal here
 
-    >>>
-    """,
-        file=sys.stderr,
-    )
-    cookies = input().strip().strip("'").strip('"')
-    cookies = cookies_txt_to_dict(cookies)
+_magnet_cache = None
 
-    return cookies
 
+def get_magnet_cache():
+    global _magnet_cache
+    if _magnet_cache is None:
+        _magnet_cache = MagnetCache(MAGNET_CACHE_PATH)
+    return _magnet_cache
 
-def deal_with_threat_defence(threat_defence_url):
-    try:
-        return solveCaptcha(threat_defence_url)
-    except Exception as e:
-        if not sys.stdout.isatty():
-            raise Exception(
-                'Failed to solve captcha automatically, please rerun this command (without a pipe `|`) and solve it manually. This process only needs to be done once'
-            ) from e
-
-        print('Failed to solve captcha, please solve manually', e)
-        return deal_with_threat_defence_manual(threat_defence_url)
-
-
-def get_page_html(target_url, cookies):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36'}
-    while True:
-        r = requests.get(target_url, headers=headers, cookies=cookies)
-        print('going to page', r.url, end=' ')
-        if 'threat_defence.php' not in r.url:
-            break
-        print('\ndefence detected')
-        cookies = deal_with_threat_defence(r.url)
-        # save cookies to json file
-        with open(COOKIES_PATH, 'w') as f:
-            json.dump(cookies, f)
-
-    data = r.text.encode('utf-8')
-    return r, data, cookies
-
-
-def extract_torrent_file(anchor, domain='rarbgunblocked.org'):
-    return (
-            'https://'
-            + domain
-            + anchor.get('href').replace('torrent/', 'download.php?id=')
-            + '&f='
-            + quote(anchor.contents[0] + '-[rarbg.to].torrent')
-            + '&tpageurl='
-            + quote(anchor.get('href').strip())
-    )
 
+_torrent_index = None
 
-def tryint(x):
-    try:
-        return int(x)
-    except ValueError as e:
-        print('[W]:' + e)
+
+def get_torrent_index():
+    """every row scraped by any search, for offline searches"""
+    global _torrent_index
+    if _torrent_index is None:
+        _torrent_index = TorrentIndex(TORRENT_INDEX_PATH)
+    return _torrent_index
+
+
+_snapshot_writer = None
+
+
+def get_snapshot_writer(max_bytes=DEFAULT_MAX_BYTES):
+    """background writer of compressed listing pages to PROGRAM_HOME/history, flushed at exit"""
+    global _snapshot_writer
+    if _snapshot_writer is None:
+        _snapshot_writer = SnapshotWriter(os.path.join(PROGRAM_HOME, 'history'), max_bytes=max_bytes)
+        atexit.register(_snapshot_writer.close)
+    _snapshot_writer.max_bytes = max_bytes
+    return _snapshot_writer
+
+
+_parse_pools = {}
+
+
+def get_parse_pool(workers):
+    """a pool of `workers` parser processes, shut down at exit"""
+    if workers not in _parse_pools:
+        _parse_pools[workers] = ParsePool(workers)
+        atexit.register(_parse_pools[workers].close)
+    return _parse_pools[workers]
+
+
+_watch_store = None
+
+
+def get_watch_store():
+    """saved searches of --watch and the torrents they have already reported"""
+    global _watch_store
+    if _watch_store is None:
+        _watch_store = WatchStore(WATCH_DB_PATH)
+    return _watch_store
+
+
+_clients = {}
+
+
+def get_client(domain, torrentgalaxy_mode=None, auto_mirror=False, hedge=False):
+    """
+    one search client per mirror, all of them sharing the process wide fetch engine.
+    with `auto_mirror` the fastest healthy mirror is used, starting with `domain` until the probes say otherwise
+    """
+    key = (normalize_domain(domain), torrentgalaxy_mode, auto_mirror, hedge)
+    if key not in _clients:
+        mirrors = MirrorManager([domain] + TORRENTGALAXY_DOMAINS) if auto_mirror else None
+        _clients[key] = RarbgSearchClient(
+            domain,
+            engine=get_engine(),
+            torrentgalaxy_mode=torrentgalaxy_mode,
+            magnet_cache=get_magnet_cache(),
+            index=get_torrent_index(),
+            mirrors=mirrors,
+            hedge=hedge,
+        )
+    return _clients[key]
 
 
 def open_url(url):
@@ -275,50 +187,6 @@ async def open_torrentfiles(urls):
             await asyncio.sleep(0.5)
 
 
-def extract_magnet(anchor):
-    # real:
-    #     https://rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
-    #     https://rarbgaccess.org/download.php?id=...&      f=...-[rarbg.com].torrent
-    # https://www.rarbgaccess.org/download.php?id=...&h=120&f=...-[rarbg.to].torrent
-    # matches anything containing "over/*.jpg" *: anything
-    regex = r'over\/(.*)\.jpg\\'
-    trackers = 'http%3A%2F%2Ftracker.trackerfix.com%3A80%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2710&tr=udp%3A%2F%2F9.rarbg.to%3A2710'
-    try:
-        hash = re.search(regex, str(anchor))[1]
-        title = quote(anchor.get('title'))
-        return f'magnet:?xt=urn:btih:{hash}&dn={title}&tr={trackers}'
-    except Exception:
-        return ''
-
-
-size_units = {
-    'B': 1,
-    'KB': 10 ** 3,
-    'MB': 10 ** 6,
-    'GB': 10 ** 9,
-    'TB': 10 ** 12,
-    'PB': 10 ** 15,
-    'EB': 10 ** 18,
-    'ZB': 10 ** 21,
-    'YB': 10 ** 24,
-}
-
-
-def parse_size(size: str):
-    number, unit = [string.strip() for string in size.strip().split()]
-    return int(float(number) * size_units[unit])
-
-
-def format_size(size: int, block_size=None):
-    """automatically format the size to the most appropriate unit"""
-    if block_size is None:
-        for unit in reversed(list(size_units.keys())):
-            if size >= size_units[unit]:
-                return f'{size / size_units[unit]:.2f} {unit}'
-    else:
-        return f'{size / size_units[block_size]:.2f} {block_size}'
-
-
 def dict_to_fname(d):
     # copy and sanitize
     white_list = {'limit', 'category', 'order', 'search', 'descending'}
@@ -327,17 +195,6 @@ def dict_to_fname(d):
     return filename
 
 
-def unique(dicts):
-    seen = set()
-    deduped = []
-    for d in dicts:
-        t = tuple(d.items())
-        if t not in seen:
-            seen.add(t)
-            deduped.append(d)
-    return deduped
-
-
 def get_user_input_interactive(torrent_dicts, start_index=0, current_page=None, total_pages=None):
     header = ' '.join(
         ['SN'.ljust(4), 'TORRENT NAME'.ljust(80), 'SEEDS'.ljust(6), 'LEECHES'.ljust(6), 'SIZE'.center(12), 'UPLOADER'])
@@ -399,6 +256,17 @@ def get_args(argv=None):
         default='rargb.to/',
         help='Domain to search, you could put an alternative mirror domain here',
     )
+    parser.add_argument(
+        '--auto_mirror',
+        '-a',
+        action='store_true',
+        help='Search the fastest healthy mirror (--domain is tried first) and fail over when a mirror times out',
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        help='With --auto_mirror, request the first page from the two best mirrors and keep the fastest',
+    )
     parser.add_argument(
         '--order',
         '-r',
@@ -419,9 +287,33 @@ def get_args(argv=None):
         default=None,
         help='Force show torrents without download or magnet links.',
     )
+    parser.add_argument(
+        '--prefetch',
+        '-p',
+        type=int,
+        default=0,
+        metavar='K',
+        help='Fetch the next K result pages concurrently while the current page is being processed',
+    )
 
     output_group = parser.add_argument_group('Output options')
     output_group.add_argument('--magnet', '-m', action='store_true', help='Output magnet links')
+    output_group.add_argument(
+        '--format',
+        '-f',
+        dest='output_format',
+        choices=OUTPUT_FORMATS,
+        default='json',
+        help='json: one indented list at the end. ndjson: one compact object per line, '
+             'streamed as soon as each result is ready when no --sort is given',
+    )
+    output_group.add_argument(
+        '--fields',
+        '-F',
+        default=None,
+        metavar='FIELDS',
+        help='Comma separated fields to output, e.g. "title,magnet,size". all fields by default',
+    )
     output_group.add_argument(
         '--sort',
         '-s',
@@ -457,12 +349,81 @@ def get_args(argv=None):
     misc_group = parser.add_argument_group('Miscilaneous')
     misc_group.add_argument('--no_cache', '-nc', action='store_true',
                             help="Don't use cached results from previous searches")
+    misc_group.add_argument(
+        '--cache_ttl',
+        type=float,
+        default=DEFAULT_TTL,
+        metavar='SECONDS',
+        help='Reuse cached results of the same search for this many seconds',
+    )
     misc_group.add_argument(
         '--no_cookie',
         '-nk',
         action='store_true',
         help="Don't use CAPTCHA cookie from previous runs (will need to resolve a new CAPTCHA)",
     )
+    misc_group.add_argument(
+        '--deadline',
+        type=float,
+        default=None,
+        metavar='SECONDS',
+        help='Stop the search after this many seconds, even mid request, and output what was found so far',
+    )
+    misc_group.add_argument(
+        '--window',
+        type=int,
+        default=0,
+        metavar='N',
+        help='With streamed output or --sort, keep only the last N results in memory (for deduplication), '
+             'so memory stays flat however many pages the search spans. 0 keeps every result',
+    )
+    misc_group.add_argument(
+        '--parse_workers',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Parse pages in N worker processes, for large scrapes. 0 parses in this process',
+    )
+    misc_group.add_argument(
+        '--max_per_domain',
+        type=int,
+        default=DEFAULT_MAX_PER_DOMAIN,
+        metavar='N',
+        help='Most requests in flight to one mirror, concurrency adapts below it to what the mirror tolerates',
+    )
+    misc_group.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='Save the raw listing pages, compressed, to ' + os.path.join(PROGRAM_HOME, 'history'),
+    )
+    misc_group.add_argument(
+        '--snapshot_max_mb',
+        type=float,
+        default=DEFAULT_MAX_BYTES / 2 ** 20,
+        metavar='MB',
+        help='Delete the oldest snapshots once they take more than this',
+    )
+    watch_group = parser.add_argument_group('Watch')
+    watch_group.add_argument(
+        '--watch',
+        '-w',
+        default=None,
+        metavar='NAME',
+        help='Save this search as NAME and re-check it every --watch_interval seconds, '
+             'outputting only torrents it has not reported before. runs until interrupted',
+    )
+    watch_group.add_argument(
+        '--watch_interval',
+        type=float,
+        default=DEFAULT_INTERVAL,
+        metavar='SECONDS',
+        help='Seconds between two checks of a watched search',
+    )
+    watch_group.add_argument(
+        '--watch_once',
+        action='store_true',
+        help='Check the watched search a single time and exit',
+    )
     args = parser.parse_args(argv)
 
     if args.interactive is None:
@@ -477,18 +438,20 @@ def get_args(argv=None):
     return args
 
 
-def load_cookies(no_cookie):
-    # read cookies from json file
-    cookies = {}
-    # make empty cookie if cookie doesn't already exist
-    if not os.path.exists(COOKIES_PATH):
-        with open(COOKIES_PATH, 'w') as f:
-            json.dump({}, f)
-
-    if not no_cookie:
-        with open(COOKIES_PATH, 'r') as f:
-            cookies = json.load(f)
-    return cookies
+def watch_search(client, emit, name, search, category, order, sort_order, interval, once=False):
+    """save the search as the watch `name`, then emit the new torrents of each of its checks"""
+    watcher = Watcher(client, get_watch_store())
+    watcher.add(name, search, category, order, sort_order, interval)
+    found = []
+    try:
+        for _, records in watcher.run([name], once=once):
+            print(f'{len(records)} new torrents for {name}')
+            for record in records:
+                emit(record)
+                found.append(record.magnet)
+    except KeyboardInterrupt:
+        print('\nUser exit')
+    return found
 
 
 def cli(argv=None):
@@ -497,36 +460,6 @@ def cli(argv=None):
     return main(**vars(args), _session_name=dict_to_fname(args))
 
 
-def build_url(search, page, category, domain, order, sort_order, torrentgalaxy_mode=False):
-    if not torrentgalaxy_mode:
-        target_url = 'https://{domain}/torrents.php?search={search}&page={page}'
-        target_url_formatted = target_url.format(
-            domain=domain.strip(),
-            search=quote(search),
-            page=page,
-        )
-        if sort_order:
-            target_url_formatted += '&by=' + sort_order.upper().strip()
-        if order:
-            target_url_formatted += '&order=' + order.strip()
-        if category:
-            target_url_formatted += '&category=' + ';'.join(CATEGORY2CODE[category])
-        return target_url_formatted
-    else:
-        target_url = 'https://{domain}/{category}/{page}?search={search}'
-        target_url_formatted = target_url.format(
-            domain=domain.strip().rstrip('/'),
-            search=quote(search),
-            page=page,
-            category='search' if len(search) else TORRENTGALAXY_CATEGORY2CODE.get(category, ''),
-        )
-        if sort_order:
-            target_url_formatted += '&by=' + sort_order.upper().strip()
-        if order:
-            target_url_formatted += '&order=' + order.strip()
-        return target_url_formatted
-
-
 def main(
         search,
         category='',
@@ -544,40 +477,44 @@ def main(
         _session_name='untitled',  # unique name based on args, used for caching
         torrentgalaxy_mode=None,
         show_empty=False,  # will show torrents that have no magnet link
+        cache_ttl=DEFAULT_TTL,  # seconds a cached query result is reused for
+        prefetch=0,  # number of pages to fetch ahead while the current page is being processed
+        auto_mirror=False,  # pick the fastest healthy mirror and fail over to the next one
+        hedge=False,  # race the two best mirrors for the first page
+        snapshot=False,  # save the raw listing pages in the background
+        snapshot_max_mb=DEFAULT_MAX_BYTES / 2 ** 20,
+        output_format='json',  # 'json' or 'ndjson'
+        fields=None,  # comma separated fields to output, None for all
+        watch=None,  # name to save the search under and re-check it, outputting only new torrents
+        watch_interval=DEFAULT_INTERVAL,
+        watch_once=False,
+        max_per_domain=DEFAULT_MAX_PER_DOMAIN,  # most requests in flight to one mirror
+        deadline=None,  # seconds after which the search stops, outputting what was found so far
+        parse_workers=0,  # parser processes, 0 to parse in this process
+        window=0,  # results kept in memory when streaming or sorting, 0 for all
 ):
-    if torrentgalaxy_mode is None:
-        torrentgalaxy_mode = 'https://' + domain.lstrip('https://').lstrip('http://').rstrip(
-            '/') in TORRENTGALAXY_DOMAINS
-
-    cookies = load_cookies(no_cookie)
+    client = get_client(domain, torrentgalaxy_mode, auto_mirror, hedge)
+    # bounds the whole run, a fetch or detail page still in flight then is abandoned
+    stop_at = None if deadline is None else time.monotonic() + deadline
+    torrentgalaxy_mode = client.torrentgalaxy_mode
+    client.scheduler.max_per_domain = max_per_domain
+    client.parse_pool = get_parse_pool(parse_workers) if parse_workers else None
+    if no_cookie:
+        client.engine.set_cookies({})
+    else:
+        client.engine.cookie_store.reload()
 
-    # TODO: make this parallel
-    def process_dict(d):
-        if not d['magnet']:
-            print('fetching magnet link for', d['title'])
-            try:
-                html_subpage = requests.get(d['href'], cookies=cookies).text.encode('utf-8')
-                parsed_html_subpage = BeautifulSoup(html_subpage, 'html.parser')
-                d['magnet'] = parsed_html_subpage.select_one('a[href^="magnet:"]').get('href')
-                d['torrent_file'] = parsed_html_subpage.select_one('a[href^="/download.php"]').get('href')
-            except Exception:
-                pass
-
-    def print_results(dicts):
+    def print_results(records):
         if sort:
-            dicts.sort(key=lambda x: x[sort], reverse=True)
-        if limit < float('inf'):
-            dicts = dicts[: int(limit)]
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            concurrent.futures.wait([executor.submit(process_dict, d) for d in dicts])
+            # sizes are bytes, so this orders numerically (vectorized when numpy is installed)
+            records = sorted_records(records, sort)
+        # magnet links are resolved lazily: only for the records that survived sorting and the limit,
+        # torrents listed under several detail pages are only taken once
+        records = client.take(records, limit, show_empty, stop_at)
+        dicts = [record.to_dict(block_size) for record in records]
 
-        # pretty print unique(dicts) as yaml
-        # print('torrents:', yaml.dump(unique(dicts), default_flow_style=False))
-
-        # reads file then merges with new dicts
-        with open(cache_file, 'w', encoding='utf8') as f:
-            json.dump(unique(dicts), f, indent=4)
+        # pretty print dicts as yaml
+        # print('torrents:', yaml.dump(dicts, default_flow_style=False))
 
         # open torrent urls in browser in the background (with delay between each one)
         if download_torrents is True or interactive and input(
@@ -592,16 +529,28 @@ def main(
 
         if magnet:
             real_print('\n'.join([t['magnet'] for t in dicts]))
+        elif output_format == 'ndjson':
+            writer = NdjsonWriter(fields=fields)
+            for d in dicts:
+                writer.write_dict(d)
         else:
-            real_print(json.dumps(dicts, indent=4))
+            real_print(json.dumps([project(d, parse_fields(fields)) for d in dicts], indent=4))
         return [t['magnet'] for t in dicts]
 
-    def interactive_loop(dicts, current_page=None, total_pages=None):
+    def emit(record):
+        if magnet:
+            real_print(record.magnet, flush=True)
+        else:
+            writer.write(record)
+
+    def interactive_loop(records, current_page=None, total_pages=None):
         while interactive:
             os.system('cls||clear')
             user_input = get_user_input_interactive(
-                dicts, start_index=len(dicts_all) - len(dicts_current), current_page=current_page,
-                total_pages=total_pages
+                [record.to_dict(block_size) for record in records],
+                start_index=len(records_all) - len(records),
+                current_page=current_page,
+                total_pages=total_pages,
             )
             print('user_input', user_input)
             if user_input is None:  # next page
@@ -609,10 +558,10 @@ def main(
             elif user_input == 'next':
                 break
             elif user_input == 'all':
-                print_results(dicts_all)
+                print_results(records_all)
             else:  # indexes
                 input_index = int(user_input)
-                print_results([dicts[input_index]])
+                print_results([records[input_index]])
             try:
                 user_input = input('[ENTER]: back to results, [q or ctrl+C]: (q)uit')
             except KeyboardInterrupt:
@@ -624,23 +573,34 @@ def main(
             elif user_input == '':
                 continue
 
-    # == dealing with cache and history ==
-    cache_file = os.path.join(PROGRAM_HOME, 'history', _session_name + '.json')
-    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-    if os.path.exists(cache_file) and not no_cache:
-        try:
-            with open(cache_file, 'r') as f:
-                cache = json.load(f)
-        except Exception as e:
-            print('Error:', e)
-            traceback.print_exc()
-            os.remove(cache_file)
-            cache = []
-    else:
-        cache = []
+    writer = NdjsonWriter(fields=fields, block_size=block_size)
+    if watch:
+        # a watch runs until interrupted, so its torrents are always streamed, one line each
+        return watch_search(client, emit, watch, search, category, order or 'data', sort_order, watch_interval,
+                            watch_once)
 
-    dicts_all = []
-    i = 1
+    # == dealing with cache and history ==
+    snapshots = get_snapshot_writer(int(snapshot_max_mb * 2 ** 20)) if snapshot else None
+    query_cache = get_query_cache(cache_ttl)
+    if not no_cache and not interactive:
+        cached = query_cache.get(search, category, order, sort_order, show_empty, limit=limit)
+        if cached is not None:
+            print(f'using {len(cached)} cached results, pass --no_cache to search again')
+            return print_results(cached)
+
+    complete = True
+    # with --sort, the best `limit` records are selected incrementally instead of sorting everything at the end
+    selector = TopK(limit, sort, slack=topk_slack(limit)) if sort else None
+    stop_when_full = server_ordered(order, sort, sort_order)
+    # without a sort, interactive menu or downloads, every result is final once its page is resolved,
+    # so it's written right away instead of after the last page
+    stream = (magnet or output_format == 'ndjson') and not sort and not interactive and not download_torrents
+    # when nothing needs every record at the end, only the last `window` ones are kept, for deduplication
+    bounded = bool(window) and (stream or selector is not None) and not interactive
+    # every torrent of this search once, with its latest seeders / leechers
+    records_all = RecordIndex(max_records=window if bounded else None)
+    streamed = deque(maxlen=window if bounded else None)
+    streamed_count = found_count = 0
 
     warnings.warn(
         'You are using one of the torrentgalaxy mirrors. These are not fully supported yet.\n'
@@ -648,101 +608,68 @@ def main(
         'Please raise any issues in https://github.com/FarisHijazi/rarbgcli/issues',
     )
 
-    while True:  # for all pages
-        target_url_formatted = build_url(search, i, category, domain, order, sort_order,
-                                         torrentgalaxy_mode=torrentgalaxy_mode)
-        r, html, cookies = get_page_html(target_url_formatted, cookies=cookies)
-
-        with open(os.path.join(os.path.dirname(cache_file), _session_name + f'_torrents_{i}.html'), 'w',
-                  encoding='utf8') as f:
-            f.write(r.text)
-        parsed_html = BeautifulSoup(html, 'html.parser')
-        torrents = parsed_html.select('tr.lista2 a[href^="/torrent/"][title]')
-
-        total_pages = '1?'
+    if stream and limit < float('inf') and client.stream_parse and not snapshots and not prefetch:
+        # only a few results wanted: listing rows are parsed, resolved and written while their page downloads.
+        # the search stops part way through a page, so it isn't cached
+        records = client.iter_records(search, category=category, order=order, limit=limit, sort_order=sort_order,
+                                      show_empty=show_empty, stop_at=stop_at)
         try:
-            pagelinks = parsed_html.select('#pager_links > a')
-            total_pages = tryint(pagelinks[-1].text)
-            if total_pages is None:
-                total_pages = tryint(pagelinks[-3].text)
-        except Exception:
-            # print('[W] failed to get total pages')
-            pass
-
-        if r.status_code != 200:
-            print('error', r.status_code)
-            break
-
-        print(f'{len(torrents)} torrents found in page')
-        if len(torrents) == 0:
-            break
-        magnets = list(map(extract_magnet, torrents))
-        torrentfiles = list(map(partial(extract_torrent_file, domain=domain), torrents))
-
-        # removed torrents and magnet links that have empty magnets, but maintained order
-        torrents, magnets, torrentfiles = zip(*[[a, m, d] for (a, m, d) in zip(torrents, magnets, torrentfiles)])
-        torrents, magnets, torrentfiles = list(torrents), list(magnets), list(torrentfiles)
-
-        table_offset = 1 if torrentgalaxy_mode else 0
-
-        dicts_current = [
-            {
-                'title': torrent.get('title'),
-                'torrent': torrentfile,
-                'href': f"https://{domain}{torrent.get('href')}",
-                'date': datetime.datetime.strptime(
-                    str(torrent.findParent('tr').select_one(f'td:nth-child({3 + table_offset})').contents[0]),
-                    '%Y-%m-%d %H:%M:%S'
-                ).timestamp(),
-                'category': CODE2CATEGORY.get(
-                    torrent.findParent('tr')
-                    .select_one(f'td:nth-child({1 + table_offset}) img')
-                    .get('src')
-                    .split('/')[-1]
-                    .replace('cat_new', '')
-                    .replace('.gif', ''),
-                    'UNKOWN',
-                ),
-                'size': format_size(
-                    parse_size(torrent.findParent('tr').select_one(f'td:nth-child({4 + table_offset})').contents[0]),
-                    block_size),
-                'seeders': int(
-                    torrent.findParent('tr').select_one(f'td:nth-child({5 + table_offset}) > font').contents[0]),
-                'leechers': int(torrent.findParent('tr').select_one(f'td:nth-child({6 + table_offset})').contents[0]),
-                'uploader': str(torrent.findParent('tr').select_one(f'td:last-child').contents[0]),
-                'magnet': magnet,
-            }
-            for (torrent, magnet, torrentfile) in zip(torrents, magnets, torrentfiles)
-        ]
-
-        # drop those that aren't matching the category
-        if category and category != 'nonxxx':
-            dicts_current = list(filter(lambda d: d['category'] == category, dicts_current))
-        if category == 'nonxxx':
-            dicts_current = list(filter(lambda d: d['category'] != 'xxx', dicts_current))
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            concurrent.futures.wait([executor.submit(process_dict, d) for d in dicts_current])
-        # remove torrents with empty magnet links
-        if not show_empty:
-            dicts_current = list(filter(lambda d: not not d['magnet'], dicts_current))
-
-        dicts_all += dicts_current
-
-        cache = list(unique(dicts_all + cache))
-
-        if interactive and len(dicts_current) > 0:
-            interactive_loop(dicts_current, current_page=i, total_pages=total_pages)
-
-        if len(list(filter(None, torrents))) >= limit:
-            print(f'reached limit {limit}, stopping')
-            break
-        i += 1
-
-    print(f'total torrents found: {len(dicts_all)}')
+            for record in records:
+                emit(record)
+                streamed.append(record.magnet)
+                streamed_count += 1
+        except asyncio.TimeoutError:
+            print(f'deadline of {deadline}s reached, stopping')
+        records.close()
+        print(f'total torrents found: {streamed_count}')
+        return list(streamed)
+
+    pages = client.listing_pages(search, category=category, order=order, sort_order=sort_order, prefetch=prefetch,
+                                 stop_at=stop_at)
+    try:
+        for page in pages:  # for all pages
+            i = page.number
+            print('going to page', page.response.url, end=' ')
+            if snapshots is not None:
+                snapshots.write(_session_name + f'_torrents_{i}', page.response.content)
+            print(f'{page.row_count} torrents found in page')
+
+            new_records = records_all.extend(page.records)
+            found_count += len(new_records)
+            if selector is not None:
+                selector.extend(new_records)
+
+            if interactive and len(page.records) > 0:
+                interactive_loop(page.records, current_page=i, total_pages=page.total_pages or '1?')
+
+            if stream:
+                for record in client.take(new_records, limit - streamed_count, show_empty, stop_at):
+                    emit(record)
+                    streamed.append(record.magnet)
+                    streamed_count += 1
+            if page.row_count >= limit or streamed_count >= limit:
+                print(f'reached limit {limit}, stopping')
+                complete = False
+                break
+            if stop_when_full and selector.full and not interactive:
+                print(f'results are already ordered by {order}, stopping')
+                complete = False
+                break
+    except asyncio.TimeoutError:
+        # the page or detail page in flight is abandoned, what was found so far is still output
+        print(f'deadline of {deadline}s reached, stopping')
+        complete = False
+    pages.close()
+    if not records_all.evicted:
+        query_cache.put(search, records_all.records(), category, order, sort_order, show_empty, complete=complete)
+
+    print(f'total torrents found: {found_count}')
+    for mirror, stats in client.scheduler.stats().items():
+        print(f'{mirror}: {stats.completed} requests, {stats.throttled} throttled, concurrency {stats.limit}')
+    if stream:
+        return list(streamed)
     if not interactive:
-        dicts_all = list(unique(dicts_all + cache))
-        return print_results(dicts_all)
+        return print_results(selector.sorted() if selector is not None else records_all.records())
     else:
         return []
 
@@ -0,0 +1,107 @@
+"""
+record_index - in-memory store of the records of a search session, deduplicated by infohash
+
+A torrent listed twice (on two pages, on two mirrors, or again after its seeders changed) is one
+entry: RecordIndex.add looks it up by infohash, or by its detail page path until the infohash is
+known, and merges the new observation into the stored record in O(1).
+With `max_records`, only the most recent records are kept (a sliding window), so a scrape of any
+number of pages deduplicates in constant memory.
+"""
+
+import itertools
+
+from .records import detail_path, normalize_infohash
+
+
+def record_keys(record):
+    """lookup keys of `record`: its detail page path, and its infohash once the magnet link is known"""
+    keys = []
+    if record.href:
+        keys.append('href:' + detail_path(record.href))
+    infohash = record.infohash
+    if infohash:
+        keys.append('btih:' + infohash)
+    return keys
+
+
+def merge(into, record):
+    """fold a newer observation of the same torrent into `into`: fresh counts win, known links are kept"""
+    if record is into:
+        return into
+    into.seeders = record.seeders
+    into.leechers = record.leechers
+    if record.magnet and not into.magnet:
+        into.magnet = record.magnet
+    if record.torrent_file and not into.torrent_file:
+        into.torrent_file = record.torrent_file
+    return into
+
+
+class RecordIndex:
+    """
+    records in first seen order, one per torrent
+
+    :param max_records: records kept, the oldest ones are evicted beyond it. None to keep every record
+    """
+
+    def __init__(self, records=(), max_records=None):
+        self._records = {}  # slot -> record, in insertion order
+        self._keys = {}  # lookup key -> slot
+        self._slot_keys = {}  # slot -> every key that was pointed at it, so eviction drops them all
+        self._slots = itertools.count()
+        self.max_records = max_records
+        self.evicted = 0
+        self.extend(records)
+
+    def _evict(self):
+        while len(self._records) > self.max_records:
+            slot = next(iter(self._records))
+            del self._records[slot]
+            for key in self._slot_keys.pop(slot):
+                if self._keys.get(key) == slot:
+                    del self._keys[key]
+            self.evicted += 1
+
+    def add(self, record):
+        """store or merge `record`, True when it is a torrent not seen before (within the window)"""
+        keys = record_keys(record)
+        slots = sorted({self._keys[key] for key in keys if key in self._keys})
+        if not slots:
+            slot = next(self._slots)
+            self._records[slot] = record
+            new = True
+        else:
+            # the oldest entry is kept, entries the record proves to be the same torrent are folded into it
+            slot, *duplicates = slots
+            for duplicate in duplicates:
+                keys += [key for key in self._slot_keys.pop(duplicate) if self._keys.get(key) == duplicate]
+                merge(self._records[slot], self._records.pop(duplicate))
+            merge(self._records[slot], record)
+            new = False
+        slot_keys = self._slot_keys.setdefault(slot, [])
+        for key in keys + record_keys(self._records[slot]):
+            if self._keys.get(key) != slot:
+                self._keys[key] = slot
+                slot_keys.append(key)
+        if self.max_records is not None and new:
+            self._evict()
+        return new
+
+    def extend(self, records):
+        """add every record, returns the ones that were new"""
+        return [record for record in records if self.add(record)]
+
+    def get(self, infohash):
+        return self._records.get(self._keys.get('btih:' + normalize_infohash(infohash)))
+
+    def records(self):
+        return list(self._records.values())
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, record):
+        return any(self._keys.get(key) in self._records for key in record_keys(record))
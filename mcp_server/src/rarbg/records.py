@@ -0,0 +1,114 @@
+"""
+records - typed search results returned by RarbgSearchClient
+"""
+
+import re
+from urllib.parse import urlsplit
+
+from .listing_parser import format_size, parse_size
+from .magnets import normalize_infohash
+
+INFOHASH_RE = re.compile(r'urn:btih:([0-9A-Za-z]+)')
+
+
+def detail_path(href):
+    """path of a detail page url, the same torrent on every mirror"""
+    return urlsplit(href).path or href
+
+
+class TorrentRecord:
+    """one torrent of a search result, `size` is in bytes and `date` is a unix timestamp"""
+
+    __slots__ = (
+        'title',
+        'torrent',
+        'href',
+        'date',
+        'category',
+        'size',
+        'seeders',
+        'leechers',
+        'uploader',
+        'magnet',
+        'torrent_file',
+    )
+
+    def __init__(
+            self,
+            title,
+            href,
+            torrent='',
+            date=0.0,
+            category='UNKOWN',
+            size=0,
+            seeders=0,
+            leechers=0,
+            uploader='',
+            magnet='',
+            torrent_file=None,
+    ):
+        self.title = title
+        self.torrent = torrent
+        self.href = href
+        self.date = date
+        self.category = category
+        self.size = size
+        self.seeders = seeders
+        self.leechers = leechers
+        self.uploader = uploader
+        self.magnet = magnet
+        self.torrent_file = torrent_file
+
+    @property
+    def infohash(self):
+        match = INFOHASH_RE.search(self.magnet or '')
+        return normalize_infohash(match[1]) if match else ''
+
+    def __repr__(self):
+        return f'TorrentRecord(title={self.title!r}, size={self.size}, seeders={self.seeders}, magnet={bool(self.magnet)})'
+
+    def __eq__(self, other):
+        if not isinstance(other, TorrentRecord):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    __hash__ = None
+
+    def asdict(self):
+        """all fields with their raw values, the inverse of `from_dict`"""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def to_dict(self, block_size=None):
+        """the dict layout printed by the CLI, with a human readable size"""
+        d = {
+            'title': self.title,
+            'torrent': self.torrent,
+            'href': self.href,
+            'date': self.date,
+            'category': self.category,
+            'size': format_size(self.size, block_size),
+            'seeders': self.seeders,
+            'leechers': self.leechers,
+            'uploader': self.uploader,
+            'magnet': self.magnet,
+        }
+        if self.torrent_file is not None:
+            d['torrent_file'] = self.torrent_file
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        size = d.get('size', 0)
+        return cls(
+            title=d.get('title'),
+            href=d.get('href'),
+            torrent=d.get('torrent', ''),
+            date=d.get('date', 0.0),
+            category=d.get('category', 'UNKOWN'),
+            size=parse_size(size) if isinstance(size, str) else size,
+            seeders=d.get('seeders', 0),
+            leechers=d.get('leechers', 0),
+            uploader=d.get('uploader', ''),
+            magnet=d.get('magnet', ''),
+            torrent_file=d.get('torrent_file'),
+        )
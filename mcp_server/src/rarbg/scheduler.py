@@ -0,0 +1,220 @@
+"""
+scheduler - per domain admission control of the fetch engine's requests
+
+FetchScheduler lets at most `limit` requests per domain be in flight and queues the rest in FIFO
+order. The limit adapts AIMD style: every fast 2xx/3xx response grows it by about one per round
+trip (additive increase), while a 429, a 5xx or a timeout halves it (multiplicative decrease), at
+most once per round trip. This keeps a search close to what the mirror tolerates instead of a
+fixed fan out that either under-uses it or gets throttled into the threat defence page.
+On top of that, a token bucket per domain caps the request rate, however fast the mirror answers.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_DOMAIN = 16
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_RATE = 8.0  # requests per second to one domain
+DEFAULT_BURST = 16
+
+# request errors that mean the mirror is overloaded, not that the request was wrong
+OVERLOAD_ERRORS = (httpx.TimeoutException, httpx.TransportError)
+OVERLOAD_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# snapshot of one domain, see FetchScheduler.stats
+SchedulerStats = collections.namedtuple('SchedulerStats', ['limit', 'in_flight', 'queued', 'completed', 'throttled'])
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, up to `burst` of them saved up. tokens are reserved in arrival order,
+    so the bucket can go negative: the debt is the time the latest caller has to wait
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """take a token, returns the seconds to wait before it may be used"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Domain:
+    __slots__ = ('limit', 'in_flight', 'waiters', 'completed', 'throttled', 'decreased', 'bucket')
+
+    def __init__(self, limit, bucket=None):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.waiters = collections.deque()  # futures of the queued requests, oldest first
+        self.completed = 0
+        self.throttled = 0
+        self.decreased = 0.0  # monotonic time of the last decrease
+        self.bucket = bucket
+
+
+class Slot:
+    """one admitted request, report its status code with `done` before leaving the `async with` block"""
+
+    __slots__ = ('domain', 'started', 'status')
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.started = time.monotonic()
+        self.status = None
+
+    def done(self, status):
+        self.status = status
+
+
+class FetchScheduler:
+    """
+    :param max_per_domain: upper bound of the requests in flight to one domain
+    :param initial: requests in flight to a domain before any response came back
+    :param min_concurrency: lower bound the limit never backs off below
+    :param slow: seconds, responses slower than this don't grow the limit
+    :param decrease: factor the limit is multiplied with on overload
+    :param rate: requests per second started to one domain, None for no rate limit
+    :param burst: requests that may start at once after an idle period, `rate` by default
+    """
+
+    def __init__(self, max_per_domain=DEFAULT_MAX_PER_DOMAIN, initial=DEFAULT_INITIAL_CONCURRENCY, min_concurrency=1,
+                 slow=5.0, decrease=0.5, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.max_per_domain = max_per_domain
+        self.rate = rate
+        self.burst = burst
+        self.initial = initial
+        self.min_concurrency = min_concurrency
+        self.slow = slow
+        self.decrease = decrease
+        self._domains = {}
+
+    def _domain(self, domain):
+        state = self._domains.get(domain)
+        if state is None:
+            bucket = TokenBucket(self.rate, self.burst or self.rate) if self.rate else None
+            state = self._domains[domain] = _Domain(min(self.initial, self.max_per_domain), bucket)
+        return state
+
+    def _capacity(self, state):
+        return max(self.min_concurrency, min(int(state.limit), self.max_per_domain))
+
+    async def _acquire(self, domain):
+        state = self._domain(domain)
+        if state.in_flight >= self._capacity(state) or state.waiters:
+            waiter = asyncio.get_running_loop().create_future()
+            state.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # admitted right before being cancelled: hand the slot over to the next one
+                    self._cancel(domain)
+                elif waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                raise
+        else:
+            state.in_flight += 1
+
+    def _wake(self, state):
+        while state.waiters and state.in_flight < self._capacity(state):
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                state.in_flight += 1
+                waiter.set_result(None)
+
+    async def _throttle(self, domain):
+        """wait for the domain's token bucket, the slot is already held"""
+        state = self._domain(domain)
+        delay = state.bucket.reserve() if state.bucket is not None else 0.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _cancel(self, domain):
+        """give back a slot that was admitted but never used"""
+        state = self._domain(domain)
+        state.in_flight -= 1
+        self._wake(state)
+
+    def _release(self, slot, overloaded):
+        state = self._domain(slot.domain)
+        state.in_flight -= 1
+        state.completed += 1
+        if overloaded:
+            state.throttled += 1
+            # requests started before the last decrease saw the old limit, they don't decrease it again
+            if slot.started >= state.decreased:
+                state.limit = max(self.min_concurrency, state.limit * self.decrease)
+                state.decreased = time.monotonic()
+                logger.debug('%s overloaded (%s), concurrency down to %d', slot.domain, slot.status, state.limit)
+        elif slot.status is not None and slot.status < 400 and time.monotonic() - slot.started < self.slow:
+            state.limit = min(self.max_per_domain, state.limit + 1 / state.limit)
+        self._wake(state)
+
+    def slot(self, domain):
+        """
+        async context manager admitting one request to `domain`:
+
+            async with scheduler.slot(domain) as slot:
+                r = await client.get(url)
+                slot.done(r.status_code)
+        """
+        return _SlotContext(self, domain)
+
+    # == metrics ==
+
+    def stats(self, domain=None):
+        """SchedulerStats of `domain`, or a dict of them for every domain requested so far"""
+        if domain is not None:
+            state = self._domain(domain)
+            return SchedulerStats(self._capacity(state), state.in_flight, len(state.waiters), state.completed,
+                                  state.throttled)
+        return {domain: self.stats(domain) for domain in list(self._domains)}
+
+    @property
+    def in_flight(self):
+        return sum(state.in_flight for state in self._domains.values())
+
+    @property
+    def queued(self):
+        return sum(len(state.waiters) for state in self._domains.values())
+
+
+class _SlotContext:
+    __slots__ = ('scheduler', 'slot')
+
+    def __init__(self, scheduler, domain):
+        self.scheduler = scheduler
+        self.slot = Slot(domain)
+
+    async def __aenter__(self):
+        await self.scheduler._acquire(self.slot.domain)
+        try:
+            await self.scheduler._throttle(self.slot.domain)
+        except asyncio.CancelledError:
+            self.scheduler._cancel(self.slot.domain)
+            raise
+        self.slot.started = time.monotonic()
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        overloaded = (
+            self.slot.status in OVERLOAD_STATUSES
+            or exc_type is not None and issubclass(exc_type, OVERLOAD_ERRORS)
+        )
+        self.scheduler._release(self.slot, overloaded)
+        return False
@@ -0,0 +1,167 @@
+"""
+search_cache - persistent caches of the search client, stored in SQLite
+
+QueryCache: TTL cache of search results, keyed on the normalized search term, category and ordering.
+A fresh entry answers a search without any HTTP request; stale entries are dropped on read and
+the least recently used ones are evicted once the cache holds more than `max_entries` queries.
+
+MagnetCache: magnet link and torrent file of every detail page resolved so far, keyed on the page's
+path so that all mirrors share an entry. A torrent's magnet never changes, so these entries don't
+expire and each detail page is fetched once for all time.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from .records import INFOHASH_RE, TorrentRecord, detail_path, normalize_infohash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 12 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+
+
+def normalize_query(search):
+    return ' '.join(search.lower().split())
+
+
+def cache_key(search, category='', order='', sort_order=None, show_empty=False):
+    return json.dumps(
+        [normalize_query(search), category or '', order or '', (sort_order or '').lower(), bool(show_empty)],
+        separators=(',', ':'),
+    )
+
+
+class SqliteStore:
+    """a sqlite connection in autocommit mode, shared between threads behind a lock"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueryCache(SqliteStore):
+    """
+    :param path: sqlite database file, ':memory:' for a process local cache
+    :param ttl: seconds an entry stays fresh
+    :param max_entries: number of queries kept before the least recently used ones are evicted
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS queries ('
+            ' key TEXT PRIMARY KEY,'
+            ' created REAL NOT NULL,'
+            ' accessed REAL NOT NULL,'
+            ' complete INTEGER NOT NULL,'
+            ' records TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS queries_accessed ON queries (accessed)')
+
+    def get(self, search, category='', order='', sort_order=None, show_empty=False, limit=float('inf')):
+        """
+        cached records of a query, or None on a miss.
+        an entry scraped with a smaller limit only satisfies requests it holds enough records for
+        """
+        key = cache_key(search, category, order, sort_order, show_empty)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT created, complete, records FROM queries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            created, complete, records = row
+            if now - created > self.ttl:
+                self._conn.execute('DELETE FROM queries WHERE key = ?', (key,))
+                return None
+            records = json.loads(records)
+            if not complete and len(records) < limit:
+                return None
+            self._conn.execute('UPDATE queries SET accessed = ? WHERE key = ?', (now, key))
+        logger.debug('query cache hit for %s', key)
+        return [TorrentRecord.from_dict(d) for d in records]
+
+    def put(self, search, records, category='', order='', sort_order=None, show_empty=False, complete=True):
+        """
+        :param complete: False when the scrape stopped early (e.g. because of a limit), so it may be missing records
+        """
+        key = cache_key(search, category, order, sort_order, show_empty)
+        now = time.time()
+        payload = json.dumps([record.asdict() for record in records], separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO queries (key, created, accessed, complete, records) VALUES (?, ?, ?, ?, ?)',
+                (key, now, now, int(complete), payload),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute('DELETE FROM queries WHERE created < ?', (now - self.ttl,))
+        self._conn.execute(
+            'DELETE FROM queries WHERE key IN (SELECT key FROM queries ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM queries')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+
+class MagnetCache(SqliteStore):
+    """detail page path (see records.detail_path) -> (magnet, torrent file href), also searchable by infohash"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS magnets ('
+            ' href TEXT PRIMARY KEY,'
+            ' infohash TEXT,'
+            ' magnet TEXT NOT NULL,'
+            ' torrent_file TEXT,'
+            ' resolved REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS magnets_infohash ON magnets (infohash)')
+
+    def get(self, href, infohash=None):
+        """entry of the detail page `href` on any mirror, or else of the torrent `infohash`"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT magnet, torrent_file FROM magnets WHERE href = ?', (detail_path(href),)
+            ).fetchone()
+        if row is None and infohash:
+            return self.get_by_infohash(infohash)
+        return tuple(row) if row is not None else None
+
+    def get_by_infohash(self, infohash):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT magnet, torrent_file FROM magnets WHERE infohash = ?', (normalize_infohash(infohash),)
+            ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def put(self, href, magnet, torrent_file=None):
+        match = INFOHASH_RE.search(magnet)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO magnets (href, infohash, magnet, torrent_file, resolved) VALUES (?, ?, ?, ?, ?)',
+                (detail_path(href), normalize_infohash(match[1]) if match else None, magnet, torrent_file, time.time()),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM magnets').fetchone()[0]
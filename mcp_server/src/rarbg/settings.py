@@ -0,0 +1,63 @@
+"""
+settings - paths and site constants shared by the rarbg search client and the CLI
+"""
+
+import os
+from pathlib import Path
+
+HOME_DIRECTORY = os.environ.get('RARBGCLI_HOME', str(Path.home()))
+PROGRAM_HOME = os.path.join(HOME_DIRECTORY, '.rarbgcli')
+os.makedirs(PROGRAM_HOME, exist_ok=True)
+COOKIES_PATH = os.path.join(PROGRAM_HOME, 'cookies.json')
+QUERY_CACHE_PATH = os.path.join(PROGRAM_HOME, 'query_cache.sqlite3')
+MAGNET_CACHE_PATH = os.path.join(PROGRAM_HOME, 'magnet_cache.sqlite3')
+TORRENT_INDEX_PATH = os.path.join(PROGRAM_HOME, 'torrent_index.sqlite3')
+WATCH_DB_PATH = os.path.join(PROGRAM_HOME, 'watches.sqlite3')
+
+# trackers announced in the magnet links built from listing rows, override with a comma separated $RARBGCLI_TRACKERS
+MAGNET_TRACKERS = [
+    tracker.strip()
+    for tracker in os.environ.get(
+        'RARBGCLI_TRACKERS',
+        'http://tracker.trackerfix.com:80/announce,udp://9.rarbg.me:2710,udp://9.rarbg.to:2710',
+    ).split(',')
+    if tracker.strip()
+]
+
+TORRENTGALAXY_DOMAINS = [
+    'https://rargb.to',
+    'https://www.rarbggo.to',
+    'https://www.rarbgproxy.to',
+    'https://www.rarbgo.to',
+    'https://www.proxyrarbg.to',
+    'https://rarbg.tw',
+    'https://rarbgprx.org',
+    'https://rarbgunblock.com',
+    'https://rarbgmirror.com',
+    'https://rarbgunblock.com',
+]
+TORRENTGALAXY_CATEGORY2CODE = {
+    'movies': 'movies',
+    'xxx': 'xxx',
+    'music': 'music',
+    'tvshows': 'tvshows',
+    'software': 'software',
+    'games': 'games',
+    'nonxxx': 'nonxxx',
+}
+CATEGORY2CODE = {
+    'movies': '48;17;44;45;47;50;51;52;42;46'.split(';'),
+    'xxx': '4'.split(';'),
+    'music': '23;24;25;26'.split(';'),
+    'tvshows': '18;41;49'.split(';'),
+    'software': '33;34;43'.split(';'),
+    'games': '27;28;29;30;31;32;40;53'.split(';'),
+    'nonxxx': '2;14;15;16;17;21;22;42;18;19;41;27;28;29;30;31;32;40;23;24;25;26;33;34;43;44;45;46;47;48;49;50;51;52;54'.split(
+        ';'),
+    '': '',
+}
+CODE2CATEGORY = {}
+for category, codes in CATEGORY2CODE.items():
+    if category in ['movies', 'xxx', 'music', 'tvshows', 'software']:
+        for code in codes:
+            CODE2CATEGORY[code] = category
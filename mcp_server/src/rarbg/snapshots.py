@@ -0,0 +1,124 @@
+"""
+snapshots - optional background writer of raw listing pages
+
+Pages handed to SnapshotWriter.write are queued and returned from immediately, a daemon thread
+compresses them (zstd when the `zstandard` package is installed, gzip otherwise) and writes them
+to a directory that is kept under `max_bytes` by deleting the oldest snapshots first.
+"""
+
+import gzip
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+_STOP = object()
+
+
+def zstd_available():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class SnapshotWriter:
+    """
+    :param directory: where snapshots are written, created if missing
+    :param max_bytes: total size of the directory's snapshots, the oldest are deleted beyond it
+    :param compression: 'zstd' or 'gzip', zstd when available by default
+    :param max_pending: pages queued at most, further pages are dropped rather than blocking the caller
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, compression=None, max_pending=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression = compression or ('zstd' if zstd_available() else 'gzip')
+        self.extension = '.zst' if self.compression == 'zstd' else '.gz'
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._total = None  # bytes currently stored, computed by the writer thread on its first page
+
+    def write(self, name, content):
+        """queue `content` (bytes or str) to be saved as `name`.html + compression extension, never blocks"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rarbg-snapshots', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((name, content))
+        except queue.Full:
+            logger.debug('snapshot queue full, dropping %s', name)
+
+    def _compress(self, data):
+        if self.compression == 'zstd':
+            import zstandard
+
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def _snapshots(self):
+        """(mtime, size, path) of the stored snapshots, oldest first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(('.html.zst', '.html.gz')):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return sorted(entries)
+
+    def _rotate(self):
+        snapshots = self._snapshots()
+        self._total = sum(size for _, size, _ in snapshots)
+        for _, size, path in snapshots:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug('failed to remove snapshot %s: %s', path, e)
+                continue
+            self._total -= size
+
+    def _save(self, name, content):
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        data = self._compress(content)
+        path = os.path.join(self.directory, name + '.html' + self.extension)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if self._total is None:
+            self._rotate()
+        else:
+            self._total += len(data)
+            if self._total > self.max_bytes:
+                self._rotate()
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._save(*item)
+            except Exception as e:
+                logger.warning('failed to write snapshot %s: %s', item[0], e)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """block until every queued page is written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
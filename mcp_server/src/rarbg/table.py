@@ -0,0 +1,144 @@
+"""
+table - columnar view of search records for vectorized filtering, sorting and top-k
+
+TorrentTable keeps the numeric fields of its records (size in bytes, seeders, leechers, date) and
+a category code as NumPy arrays next to the records themselves, so filtering and ordering thousands
+of rows aggregated across pages and mirrors is a handful of array operations instead of Python
+lambdas. Sizes stay integers until output, where TorrentRecord.to_dict formats them.
+NumPy is optional: `sorted_records` falls back to `sorted` when it isn't installed.
+"""
+
+from operator import attrgetter
+
+NUMERIC_COLUMNS = ('size', 'seeders', 'leechers', 'date')
+
+
+def numpy_available():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class TorrentTable:
+    """
+    :param records: TorrentRecord objects, in their original order
+    """
+
+    def __init__(self, records=(), _columns=None):
+        import numpy as np
+
+        self.records = list(records)
+        if _columns is not None:
+            self.columns = _columns
+            return
+        n = len(self.records)
+        self.columns = {
+            'size': np.fromiter((r.size for r in self.records), dtype=np.int64, count=n),
+            'seeders': np.fromiter((r.seeders for r in self.records), dtype=np.int64, count=n),
+            'leechers': np.fromiter((r.leechers for r in self.records), dtype=np.int64, count=n),
+            'date': np.fromiter((r.date for r in self.records), dtype=np.float64, count=n),
+            'has_magnet': np.fromiter((bool(r.magnet) for r in self.records), dtype=bool, count=n),
+        }
+        # categories are few, they're stored as small integer codes into `categories`
+        self.categories, codes = np.unique(np.array([r.category for r in self.records], dtype=str), return_inverse=True)
+        self.columns['category'] = codes.astype(np.int16)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, name):
+        """a column, e.g. table['size']"""
+        if name == 'title':
+            import numpy as np
+
+            return np.array([r.title for r in self.records], dtype=str)
+        return self.columns[name]
+
+    def take(self, indices):
+        """a new table with the rows at `indices` (integer array or boolean mask), in that order"""
+        import numpy as np
+
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        table = TorrentTable(
+            [self.records[i] for i in indices.tolist()],
+            _columns={name: column[indices] for name, column in self.columns.items()},
+        )
+        table.categories = self.categories
+        return table
+
+    # == vectorized operations ==
+
+    def mask(self, category='', show_empty=True, min_seeders=None, min_size=None, max_size=None):
+        """boolean mask of the rows passing every given filter, `category` as in RarbgSearchClient"""
+        import numpy as np
+
+        mask = np.ones(len(self), dtype=bool)
+        if category:
+            code = np.flatnonzero(self.categories == ('xxx' if category == 'nonxxx' else category))
+            matches = self.columns['category'] == code[0] if len(code) else np.zeros(len(self), dtype=bool)
+            mask &= ~matches if category == 'nonxxx' else matches
+        if not show_empty:
+            mask &= self.columns['has_magnet']
+        if min_seeders is not None:
+            mask &= self.columns['seeders'] >= min_seeders
+        if min_size is not None:
+            mask &= self.columns['size'] >= min_size
+        if max_size is not None:
+            mask &= self.columns['size'] <= max_size
+        return mask
+
+    def filter(self, category='', show_empty=True, min_seeders=None, min_size=None, max_size=None):
+        return self.take(self.mask(category, show_empty, min_seeders, min_size, max_size))
+
+    def argsort(self, *keys, descending=True):
+        """
+        row order by `keys` (the first one most significant). ties keep their original order,
+        like `sorted(..., reverse=True)` does
+        """
+        import numpy as np
+
+        order = np.arange(len(self))
+        for key in reversed(keys):
+            column = self[key][order]
+            if descending:
+                # a stable descending sort: stable ascending sort of the reversed rows, reversed back
+                order = order[::-1][np.argsort(column[::-1], kind='stable')][::-1]
+            else:
+                order = order[np.argsort(column, kind='stable')]
+        return order
+
+    def sort(self, *keys, descending=True):
+        return self.take(self.argsort(*keys, descending=descending))
+
+    def topk(self, k, key, descending=True):
+        """the `k` best rows by `key` in O(n) + O(k log k), ordered like `sort(key)[:k]`"""
+        import numpy as np
+
+        if k >= len(self):
+            return self.sort(key, descending=descending)
+        k = int(k)
+        if key in NUMERIC_COLUMNS:
+            # partition on the kth value, then sort only the rows that can make it into the top k
+            column = self[key]
+            position = len(self) - k if descending else k - 1
+            kth = np.partition(column, position)[position]
+            candidates = np.flatnonzero(column >= kth if descending else column <= kth)
+            table = self.take(candidates)
+        else:
+            table = self
+        return table.take(table.argsort(key, descending=descending)[:k])
+
+
+def sorted_records(records, key, descending=True):
+    """`records` ordered by the attribute `key`, through a TorrentTable when NumPy is installed"""
+    records = list(records)
+    if numpy_available():
+        return TorrentTable(records).sort(key, descending=descending).records
+    return sorted(records, key=attrgetter(key), reverse=descending)
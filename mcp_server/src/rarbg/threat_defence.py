@@ -0,0 +1,264 @@
+"""
+threat_defence - solving the rarbg CAPTCHA ("threat defence") page, automatically or manually
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+import zipfile
+from functools import partial
+from http.cookies import SimpleCookie
+from io import BytesIO
+from sys import platform
+
+import wget
+
+from .http_engine import THREAT_DEFENCE_MARKER
+from .settings import PROGRAM_HOME
+
+real_print = print
+print = print if sys.stdout.isatty() else partial(print, file=sys.stderr)
+
+
+# Captcha solving taken from https://github.com/confident-hate/seedr-cli
+
+CHROMEDRIVER_PATH_ENV = 'RARBGCLI_CHROMEDRIVER'
+BROWSER_IDLE_TIMEOUT = 300  # seconds a warm browser is kept around after its last solve
+
+_chromedriver_path = None
+
+
+def chromedriver_path():
+    """resolved once per process: $RARBGCLI_CHROMEDRIVER, or the driver webdriver_manager keeps in PROGRAM_HOME"""
+    global _chromedriver_path
+    if _chromedriver_path is None:
+        _chromedriver_path = os.environ.get(CHROMEDRIVER_PATH_ENV)
+        if not _chromedriver_path:
+            from webdriver_manager.chrome import ChromeDriverManager
+
+            _chromedriver_path = ChromeDriverManager(path=PROGRAM_HOME).install()
+    return _chromedriver_path
+
+
+class CaptchaBrowser:
+    """
+    headless chrome kept warm between threat defence solves. it is started on the first solve,
+    reused by the next ones (one at a time) and quit after `idle_timeout` seconds without a solve
+
+    :param wait_timeout: seconds to wait for each step of the CAPTCHA page, instead of fixed sleeps
+    """
+
+    def __init__(self, idle_timeout=BROWSER_IDLE_TIMEOUT, wait_timeout=20):
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._driver = None
+        self._lock = threading.Lock()
+        self._last_used = 0.0
+        self._idle_timer = None
+
+    def _start(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        options.add_argument('--no-sandbox')
+        options.add_argument('--headless')
+        options.add_argument('--log-level=3')
+        options.add_argument('--disable-logging')
+        options.add_argument('--output=' + ('NUL' if sys.platform == 'win32' else '/dev/null'))
+        try:
+            from selenium.webdriver.chrome.service import Service
+
+            driver = webdriver.Chrome(service=Service(chromedriver_path()), options=options)
+        except TypeError:  # selenium 3
+            driver = webdriver.Chrome(
+                chromedriver_path(),
+                chrome_options=options,
+                service_log_path=('NUL' if sys.platform == 'win32' else '/dev/null'),
+            )
+        print('successfully loaded chrome driver')
+        return driver
+
+    def _read_captcha(self, driver):
+        import pytesseract
+        from PIL import Image
+        from selenium.webdriver.common.by import By
+
+        if platform == 'win32':
+            pytesseract.pytesseract.tesseract_cmd = os.path.join(PROGRAM_HOME, 'Tesseract-OCR', 'tesseract')
+
+        element = driver.find_elements(By.CSS_SELECTOR, 'img')[1]
+        location = element.location
+        size = element.size
+        png = driver.get_screenshot_as_png()
+        x = location['x']
+        y = location['y']
+        width = location['x'] + size['width']
+        height = location['y'] + size['height']
+        im = Image.open(BytesIO(png))
+        im = im.crop((int(x), int(y), int(width), int(height)))
+        try:
+            return pytesseract.image_to_string(im)
+        except pytesseract.TesseractNotFoundError:
+            print('Tesseract not found. Downloading tesseract ...')
+            download_tesseract(PROGRAM_HOME)
+            return pytesseract.image_to_string(im)
+
+    def _solve(self, driver, threat_defence_url):
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        wait = WebDriverWait(driver, self.wait_timeout)
+        driver.get(threat_defence_url)
+
+        # the defence page shows either the CAPTCHA form or a "Click here" link leading to it
+        wait.until(lambda d: d.find_elements(By.ID, 'solve_string') or d.find_elements(By.LINK_TEXT, 'Click here'))
+        clk_here_buttons = driver.find_elements(By.LINK_TEXT, 'Click here')
+        if clk_here_buttons:
+            clk_here_buttons[0].click()
+        wait.until(EC.element_to_be_clickable((By.ID, 'solve_string')))
+        wait.until(lambda d: len(d.find_elements(By.CSS_SELECTOR, 'img')) > 1)
+
+        text_field = driver.find_element(By.ID, 'solve_string')
+        text_field.send_keys(self._read_captcha(driver))
+        try:
+            text_field.send_keys(Keys.RETURN)
+        except Exception as e:
+            print(e)
+
+        try:
+            wait.until(lambda d: THREAT_DEFENCE_MARKER not in d.current_url)
+        except TimeoutException:
+            print('still on the threat defence page, the CAPTCHA solution was probably wrong')
+        return {c['name']: c['value'] for c in (driver.get_cookies())}
+
+    def solve(self, threat_defence_url):
+        """cookies that pass the threat defence page, blocking"""
+        with self._lock:
+            try:
+                if self._driver is None:
+                    self._driver = self._start()
+                return self._solve(self._driver, threat_defence_url)
+            except Exception:
+                self._quit()  # a browser in an unknown state is not reused
+                raise
+            finally:
+                self._last_used = time.monotonic()
+                self._schedule_idle_shutdown()
+
+    def _schedule_idle_shutdown(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        if self.idle_timeout is None or self._driver is None:
+            return
+        self._idle_timer = threading.Timer(self.idle_timeout, self._shutdown_if_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _shutdown_if_idle(self):
+        with self._lock:
+            if time.monotonic() - self._last_used >= self.idle_timeout:
+                self._quit()
+
+    def _quit(self):
+        driver, self._driver = self._driver, None
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception as e:
+                print('failed to quit chrome driver', e)
+
+    def close(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            self._quit()
+
+
+_browser = None
+_browser_lock = threading.Lock()
+
+
+def get_browser():
+    """the process wide CAPTCHA browser"""
+    global _browser
+    with _browser_lock:
+        if _browser is None:
+            _browser = CaptchaBrowser()
+            atexit.register(_browser.close)
+        return _browser
+
+
+def solveCaptcha(threat_defence_url):
+    return get_browser().solve(threat_defence_url)
+
+
+def download_tesseract(chdir='.'):
+    os.chdir(chdir)
+
+    # download for each platform if statement
+    if platform == 'win32':
+        tesseract_zip = wget.download(
+            'https://github.com/FarisHijazi/rarbgcli/releases/download/v0.0.7/Tesseract-OCR.zip', 'Tesseract-OCR.zip')
+        # extract the zip file
+        with zipfile.ZipFile(tesseract_zip, 'r') as zip_ref:
+            zip_ref.extractall()  # you can specify the destination folder path here
+        # delete the zip file downloaded above
+        os.remove(tesseract_zip)
+    elif platform in ['linux', 'linux2']:
+        os.system('sudo apt-get install tesseract-ocr')
+    else:
+        raise Exception('Unsupported platform')
+
+
+def cookies_txt_to_dict(cookies_txt: str) -> dict:
+    # SimpleCookie.load = lambda self, data: self.__init__(data.split(';'))
+    cookie = SimpleCookie()
+    cookie.load(cookies_txt)
+    return {k: v.value for k, v in cookie.items()}
+
+
+def cookies_dict_to_txt(cookies_dict: dict) -> str:
+    return '; '.join(f'{k}={v}' for k, v in cookies_dict.items())
+
+
+def deal_with_threat_defence_manual(threat_defence_url):
+    real_print(
+        f"""
+    rarbg CAPTCHA must be solved, please follow the instructions bellow (only needs to be done once in a while):
+
+    1. On any PC, open the link in a web browser: "{threat_defence_url}"
+    2. solve and submit the CAPTCHA you should be redirected to a torrent page
+    3. open the console (press F12 -> Console) and paste the following code:
+
+        console.log(document.cookie)
+
+    4. copy the output. it will look something like: "tcc; gaDts48g=q8hppt; gaDts48g=q85p9t; ...."
+    5. paste the output in the terminal here
+
+    >>>
+    """,
+        file=sys.stderr,
+    )
+    cookies = input().strip().strip("'").strip('"')
+    cookies = cookies_txt_to_dict(cookies)
+
+    return cookies
+
+
+def deal_with_threat_defence(threat_defence_url):
+    try:
+        return solveCaptcha(threat_defence_url)
+    except Exception as e:
+        if not sys.stdout.isatty():
+            raise Exception(
+                'Failed to solve captcha automatically, please rerun this command (without a pipe `|`) and solve it manually. This process only needs to be done once'
+            ) from e
+
+        print('Failed to solve captcha, please solve manually', e)
+        return deal_with_threat_defence_manual(threat_defence_url)
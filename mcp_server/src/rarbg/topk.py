@@ -0,0 +1,64 @@
+"""
+topk - bounded, incremental top-k selection of search records
+
+Instead of accumulating every scraped record and sorting the whole list to keep `limit` of them,
+TopK keeps a min-heap of the best candidates seen so far and is fed page by page, so memory is
+O(k) and each record costs O(log k).
+"""
+
+import heapq
+import itertools
+from operator import attrgetter
+
+# server side --order values and the record attribute the listing is then ordered by
+ORDER2SORT = {
+    'data': 'date',
+    'seeders': 'seeders',
+    'leechers': 'leechers',
+    'size': 'size',
+}
+
+
+def server_ordered(order, sort, sort_order=None):
+    """True when the listing pages already come sorted descending by `sort`, so the first k rows are the top k"""
+    return bool(sort) and ORDER2SORT.get(order) == sort and (sort_order or 'desc').lower() == 'desc'
+
+
+class TopK:
+    """
+    the `k` records with the largest `key`, ties keep their insertion order (like a stable descending sort)
+
+    :param k: number of records to select, float('inf') keeps everything
+    :param key: record attribute to rank by, e.g. 'seeders', 'size' or 'date'
+    :param slack: extra candidates kept beyond k, to backfill records whose magnet link can't be resolved
+    """
+
+    def __init__(self, k, key, slack=0):
+        self.k = k
+        self.key = key
+        self.capacity = k + slack
+        self._getkey = attrgetter(key)
+        self._heap = []  # (key, -sequence, record), the worst candidate at the root
+        self._sequence = itertools.count()
+
+    def push(self, record):
+        item = (self._getkey(record), -next(self._sequence), record)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, item)
+        elif item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+
+    def extend(self, records):
+        for record in records:
+            self.push(record)
+
+    @property
+    def full(self):
+        return len(self._heap) >= self.capacity
+
+    def __len__(self):
+        return len(self._heap)
+
+    def sorted(self):
+        """candidates, best first"""
+        return [record for _, _, record in sorted(self._heap, key=lambda item: item[:2], reverse=True)]
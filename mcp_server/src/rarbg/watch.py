@@ -0,0 +1,214 @@
+"""
+watch - saved searches re-checked on a schedule, yielding only the torrents not seen before
+
+A watch is a stored search (query, category, ordering) with an interval. Checking it requests the
+first listing page conditionally (If-None-Match / If-Modified-Since with the validators of the
+previous check), so a mirror that supports them answers 304 and nothing is parsed at all. Otherwise
+pages are read newest first until one contains a torrent already known to the watch, which for a
+search that gained a few uploads since is a single page instead of a full scrape.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from contextlib import aclosing
+
+from .record_index import RecordIndex, record_keys
+from .search_cache import SqliteStore, normalize_query
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60 * 60
+DEFAULT_MAX_PAGES = 5
+
+Watch = namedtuple('Watch', ['name', 'query', 'category', 'order', 'sort_order', 'interval', 'last_run', 'etag',
+                             'last_modified'])
+WATCH_COLUMNS = 'name, query, category, "order", sort_order, interval, last_run, etag, last_modified'
+
+
+class WatchStore(SqliteStore):
+    """
+    the watches, the validators of their last check and the keys (see record_index.record_keys) of every torrent
+    they have seen
+
+    :param path: sqlite database file, ':memory:' for a process local store
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS watches ('
+            ' name TEXT PRIMARY KEY,'
+            ' query TEXT NOT NULL,'
+            ' category TEXT NOT NULL,'
+            ' "order" TEXT NOT NULL,'
+            ' sort_order TEXT,'
+            ' interval REAL NOT NULL,'
+            ' last_run REAL,'
+            ' etag TEXT,'
+            ' last_modified TEXT);'
+            'CREATE TABLE IF NOT EXISTS watch_seen ('
+            ' name TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' PRIMARY KEY (name, key)) WITHOUT ROWID;'
+        )
+
+    def put(self, name, query, category='', order='data', sort_order=None, interval=DEFAULT_INTERVAL):
+        """create or redefine a watch. redefining it keeps its seen torrents unless the search changed"""
+        query = normalize_query(query)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT query, category, "order", sort_order FROM watches WHERE name = ?', (name,)
+            ).fetchone()
+            if row is not None and tuple(row) == (query, category, order, sort_order):
+                self._conn.execute('UPDATE watches SET interval = ? WHERE name = ?', (interval, name))
+                return
+            self._conn.execute('BEGIN')
+            self._conn.execute('DELETE FROM watch_seen WHERE name = ?', (name,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO watches (name, query, category, "order", sort_order, interval)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (name, query, category, order, sort_order, interval),
+            )
+            self._conn.execute('COMMIT')
+
+    def remove(self, name):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute('DELETE FROM watch_seen WHERE name = ?', (name,))
+            self._conn.execute('DELETE FROM watches WHERE name = ?', (name,))
+            self._conn.execute('COMMIT')
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute(f'SELECT {WATCH_COLUMNS} FROM watches WHERE name = ?', (name,)).fetchone()
+        return Watch(*row) if row is not None else None
+
+    def watches(self):
+        with self._lock:
+            rows = self._conn.execute(f'SELECT {WATCH_COLUMNS} FROM watches ORDER BY name').fetchall()
+        return [Watch(*row) for row in rows]
+
+    def known(self, name, keys):
+        """the subset of `keys` already seen by the watch `name`"""
+        keys = list(keys)
+        if not keys:
+            return set()
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key FROM watch_seen WHERE name = ? AND key IN ({", ".join("?" * len(keys))})',
+                [name, *keys],
+            ).fetchall()
+        return {key for key, in rows}
+
+    def record_check(self, name, keys=(), etag=None, last_modified=None, when=None):
+        """store the outcome of a check: the keys it saw, and the validators to send next time (None keeps them)"""
+        when = time.time() if when is None else when
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO watch_seen (name, key) VALUES (?, ?)', [(name, key) for key in keys]
+            )
+            self._conn.execute(
+                'UPDATE watches SET last_run = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)'
+                ' WHERE name = ?',
+                (when, etag, last_modified, name),
+            )
+            self._conn.execute('COMMIT')
+
+
+class Watcher:
+    """
+    :param client: RarbgSearchClient the watches are checked with
+    :param store: WatchStore
+    :param max_pages: most pages read in one check when no known torrent is reached
+    """
+
+    def __init__(self, client, store, max_pages=DEFAULT_MAX_PAGES):
+        self.client = client
+        self.store = store
+        self.max_pages = max_pages
+
+    def add(self, name, query, category='', order='data', sort_order=None, interval=DEFAULT_INTERVAL):
+        """
+        watch a search. the listing should be ordered newest first (order='data', the default),
+        otherwise new torrents can hide behind known ones and are only found within `max_pages`
+        """
+        self.store.put(name, query, category, order, sort_order, interval)
+
+    def remove(self, name):
+        self.store.remove(name)
+
+    def list(self):
+        return self.store.watches()
+
+    async def _check(self, watch):
+        """the new torrents of `watch`, resolved, in listing order. must run on the engine loop"""
+        headers = {}
+        if watch.etag:
+            headers['If-None-Match'] = watch.etag
+        if watch.last_modified:
+            headers['If-Modified-Since'] = watch.last_modified
+        # the first check of a watch only takes its baseline from the first page
+        max_pages = 1 if watch.last_run is None else self.max_pages
+        new, keys = RecordIndex(), set()
+        etag = last_modified = None
+        pages = self.client._listing_pages(watch.query, watch.category, watch.order, watch.sort_order, headers=headers)
+        async with aclosing(pages) as pages:
+            async for page in pages:
+                if page.response.status_code == 304:
+                    logger.debug('%s: not modified', watch.name)
+                    break
+                if page.number == 1:
+                    etag = page.response.headers.get('ETag')
+                    last_modified = page.response.headers.get('Last-Modified')
+                page_keys = {key for record in page.records for key in record_keys(record)}
+                known = self.store.known(watch.name, page_keys)
+                new.extend(
+                    record for record in page.records if not any(key in known for key in record_keys(record))
+                )
+                keys |= page_keys
+                if known or page.number >= max_pages:
+                    break
+        records = [record async for record in self.client._take(new.records(), show_empty=True)]
+        # resolved records also know their infohash now, so a relisting under another detail page is recognized
+        keys.update(key for record in records for key in record_keys(record))
+        self.store.record_check(watch.name, keys, etag, last_modified)
+        logger.info('%s: %d new torrents', watch.name, len(records))
+        return records
+
+    def _get(self, name):
+        watch = self.store.get(name)
+        if watch is None:
+            raise KeyError(f'no watch named {name!r}')
+        return watch
+
+    def check(self, name):
+        """check the watch `name` now, returns its new TorrentRecord objects"""
+        return self.client.engine.run(self._check(self._get(name)))
+
+    async def acheck(self, name):
+        """`check` for async callers, can be awaited from any event loop"""
+        return await self.client.engine.arun(self._check(self._get(name)))
+
+    def run(self, names=None, once=False):
+        """
+        blocking generator of (name, new records), checking each watch (all of them, or those in `names`)
+        whenever its interval has passed. with `once`, every watch is checked right away, a single time
+        """
+        while True:
+            watches = [watch for watch in self.store.watches() if names is None or watch.name in names]
+            if not watches:
+                return
+            now = time.time()
+            for watch in watches:
+                if once or watch.last_run is None or now >= watch.last_run + watch.interval:
+                    yield watch.name, self.client.engine.run(self._check(watch))
+            if once:
+                return
+            watches = [watch for watch in self.store.watches() if names is None or watch.name in names]
+            if not watches:
+                return
+            wait = min((watch.last_run or 0) + watch.interval for watch in watches) - time.time()
+            if wait > 0:
+                time.sleep(wait)